@@ -11,6 +11,7 @@ class SessionKey(StrEnum):
     CREATE_UPDATE_BET_LIST_ACTION = "create_update_bet_list_action"
     UPDATE_BET_LIST_NAME = "update_bet_list_name"
     NU_BET_LIST_MATCHES = 'new_updated_bet_list_matches'
+    SEARCHED_MATCHES = 'searched_matches'
 
     def is_in_session(self):
         if self in st.session_state:
@@ -1,8 +1,10 @@
 import streamlit as st
 from data import (
-    get_bet_lists_wide_df,
-    get_winning_and_losing_bet_lists,
-    get_winning_and_losing_bet_lists_count
+    SETTLED_BET_LISTS_PAGE_SIZE,
+    get_bet_list_legs,
+    get_settled_bet_lists,
+    get_settled_bet_lists_count,
+    settle_bet_lists
 )
 
 def highlight_losing_odds(row):
@@ -11,30 +13,44 @@ def highlight_losing_odds(row):
     else:
         return ['' for r in row]
 
+def get_settled_bet_lists_page(is_winning, bet_list_count, key):
+    # Only the settled bet lists of the chosen page, and their legs, are read
+    page_count = max(1, -(-bet_list_count // SETTLED_BET_LISTS_PAGE_SIZE))
+    page = st.number_input(
+        f'Page (of {page_count})',
+        min_value=1,
+        max_value=page_count,
+        value=1,
+        step=1,
+        key=key
+    )
+    df_settled_bet_lists = get_settled_bet_lists(is_winning, page=page - 1)
+    if df_settled_bet_lists.empty:
+        return df_settled_bet_lists, {}
+    df_legs = get_bet_list_legs(tuple(df_settled_bet_lists.index))
+    return df_settled_bet_lists, dict(tuple(df_legs.groupby('bet_list_name', sort=False)))
+
 
 st.header('At-term bet lists')
 
-df_at_term_bet_lists = get_bet_lists_wide_df()
-dc_win_lost_bet_lists = get_winning_and_losing_bet_lists(df_at_term_bet_lists)
-dc_win_lose_bet_lists_count = get_winning_and_losing_bet_lists_count(dc_win_lost_bet_lists)
+settle_bet_lists()
+dc_win_lose_bet_lists_count = get_settled_bet_lists_count()
 win_col, lose_col = st.columns(2)
 win_col.metric(label=r"# Winning bet lists", value=dc_win_lose_bet_lists_count["winning"])
 lose_col.metric(label=r"# Losing bet lists", value=dc_win_lose_bet_lists_count["losing"])
 win_bl_tab, lose_bl_tab = st.tabs(["🟩 &nbsp; &nbsp; Winning Bet Lists", "🟥 &nbsp; &nbsp; Losing Bet Lists"])
 with win_bl_tab:
-    winning_bet_lists = [
-        bl_name 
-        for bl_name, is_winning in dc_win_lost_bet_lists.items()
-        if is_winning == True
-    ]
-    for bet_list_name in winning_bet_lists:
+    df_winning_bet_lists, dc_bet_list_dfs = get_settled_bet_lists_page(
+        True, dc_win_lose_bet_lists_count["winning"], key='winning_bet_lists_page'
+    )
+    for bet_list in df_winning_bet_lists.itertuples():
+        bet_list_name = bet_list.Index
         df_bet_list = (
-            df_at_term_bet_lists
-            .query('bet_list_name == @bet_list_name')
+            dc_bet_list_dfs[bet_list_name]
             .drop(columns=["bet_list_name", "is_winning"])
         )
-        total_odds = f'{df_bet_list.odd_value.product():.2f}'
-        match_count = df_bet_list.description.count()
+        total_odds = f'{bet_list.odds_product:.2f}'
+        match_count = bet_list.match_count
         with st.expander(
             f"**{bet_list_name}**  \n"
             f"∑ Odds: :green[{total_odds}] &nbsp; &nbsp; &nbsp; \# Matches: :green[{match_count}]"
@@ -47,20 +63,18 @@ with win_bl_tab:
                 }
             )
 with lose_bl_tab:
-    losing_bet_lists = [
-        bl_name 
-        for bl_name, is_winning in dc_win_lost_bet_lists.items()
-        if is_winning == False
-    ]
-    for bet_list_name in losing_bet_lists:
+    df_losing_bet_lists, dc_bet_list_dfs = get_settled_bet_lists_page(
+        False, dc_win_lose_bet_lists_count["losing"], key='losing_bet_lists_page'
+    )
+    for bet_list in df_losing_bet_lists.itertuples():
+        bet_list_name = bet_list.Index
         df_bet_list = (
-            df_at_term_bet_lists
-            .query('bet_list_name == @bet_list_name')
+            dc_bet_list_dfs[bet_list_name]
             .drop(columns=["bet_list_name"])
         )
-        total_odds = f'{df_bet_list.odd_value.product():.2f}'
-        match_count = df_bet_list.description.count()
-        losing_match_count = df_bet_list.query('is_winning == False').description.count()
+        total_odds = f'{bet_list.odds_product:.2f}'
+        match_count = bet_list.match_count
+        losing_match_count = bet_list.losing_match_count
         with st.expander(
             f"**{bet_list_name}**  \n"
             f"∑ Odds: :red[{total_odds}] &nbsp; &nbsp; &nbsp; \# Losing Matches: :red[{losing_match_count}/{match_count}]"
@@ -0,0 +1,77 @@
+import streamlit as st
+from data import (
+    BACKTEST_DEFAULT_STRATEGY,
+    PROGRAM_ODDS_COLUMNS,
+    get_table,
+    run_backtest
+)
+
+st.header('Backtest a strategy')
+st.caption(
+    'Every match day, all the bet lists of the chosen size that can be built from '
+    'the shortest qualifying odds (one odd per match) are bet with the same stake.'
+)
+
+df_competitions = get_table('competitions')
+dc_competitions = dict(zip(df_competitions.competition_code, df_competitions.name))
+
+with st.form('backtest_strategy_form'):
+    competition_codes = st.multiselect(
+        'Competitions',
+        options=list(dc_competitions),
+        format_func=dc_competitions.get,
+        placeholder='All competitions'
+    )
+    odd_names = st.multiselect(
+        'Markets',
+        options=PROGRAM_ODDS_COLUMNS,
+        placeholder='All markets'
+    )
+    min_odd_value, max_odd_value = st.slider(
+        'Odds range',
+        min_value=1.0,
+        max_value=20.0,
+        value=(1.2, 2.5),
+        step=0.05
+    )
+    legs_col, pool_col, stake_col = st.columns(3)
+    legs = legs_col.number_input('Odds per bet list', min_value=2, max_value=10, value=3)
+    max_odds_per_day = pool_col.number_input(
+        'Shortest odds kept per day',
+        min_value=2,
+        max_value=60,
+        value=BACKTEST_DEFAULT_STRATEGY["max_odds_per_day"]
+    )
+    stake = stake_col.number_input('Stake', min_value=1.0, value=10.0, step=1.0)
+    strategy_submitted = st.form_submit_button('Run backtest')
+
+if strategy_submitted:
+    with st.spinner('Replaying past match days...'):
+        dc_backtest = run_backtest(
+            {
+                "competition_codes": competition_codes,
+                "odd_names": odd_names,
+                "min_odd_value": min_odd_value,
+                "max_odd_value": max_odd_value,
+                "legs": legs,
+                "max_odds_per_day": max_odds_per_day,
+                "stake": stake,
+            }
+        )
+    dc_metrics = dc_backtest["metrics"]
+    roi_col, hit_rate_col, drawdown_col, count_col = st.columns(4)
+    roi_col.metric('ROI', f"{dc_metrics['roi']:.1%}")
+    hit_rate_col.metric('Hit rate', f"{dc_metrics['hit_rate']:.1%}")
+    drawdown_col.metric('Max drawdown', f"{dc_metrics['max_drawdown']:.2f}")
+    count_col.metric(r'# Bet lists', dc_metrics['bet_list_count'])
+    if dc_metrics['bet_list_count'] == 0:
+        st.info('No bet list can be built from the settled odds matching this strategy, nothing was bet.')
+    else:
+        st.line_chart(dc_backtest["df_days"], x='match_day', y='profit')
+        st.dataframe(
+            dc_backtest["df_seasons"],
+            column_config={
+                "hit_rate": st.column_config.NumberColumn(format="percent"),
+                "roi": st.column_config.NumberColumn(format="percent"),
+            }
+        )
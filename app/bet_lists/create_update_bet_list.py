@@ -11,6 +11,7 @@ from data import (
 from bet_lists.utils import (
     create_or_update_bet_list,
     display_df_program, 
+    display_match_search,
     display_new_bet_list_form,
     init_new_bet_list_in_session, 
 )
@@ -30,9 +31,12 @@ if bet_list_name:
         df_previous_bet_list_odds = None
 
     st.subheader('Match Selection')
+    ls_searched_matches = display_match_search()
 
     with st.expander('Select the matches you want to add to your bet list'):  
-        df_program_matches = display_df_program(ls_selected_matches)
+        df_program_matches = display_df_program(
+            (ls_selected_matches or []) + ls_searched_matches
+        )
 
     init_new_bet_list_in_session(df_program_matches)
     st.subheader('Bets Selection')
@@ -48,6 +48,8 @@ if selected_bet_list_name:
         f'**{match_count}** matches from **{min_date:{datetime_format}}** to **{max_date:{datetime_format}}**'
     )
     with st.expander(f'{selected_bet_list_name} matches & odds'):
+        if st.toggle('Show implied probabilities, fair odds and bookmaker margins'):
+            df_bet_list = get_bet_list_df(selected_bet_list_name, with_margins=True)
         st.dataframe(
             df_bet_list,
             column_config={
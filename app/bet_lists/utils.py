@@ -10,19 +10,18 @@ from app_session import (
 )
 from data import (
     get_program,
+    get_program_team_form,
+    search_matches,
     get_bet_list_names_in_db,
-    get_odds_table,
+    get_match_odds_cards,
     upsert_bet_list,
-    get_existing_bet_list_summary
+    get_existing_bet_list_summary,
+    get_top_system_bet_combinations,
+    save_system_bet_combinations,
+    SYSTEM_BET_RANKINGS
 )
 
-def get_odds_for_match(match, df_odds):
-    return (
-        df_odds
-        .query(
-            "odd_match_code == @match.odd_match_code"
-        )
-    )
+SYSTEM_BETS_MIN_POOL_SIZE = 3
 
 def init_new_bet_list_in_session(df_program_matches):
     selected_matches = (
@@ -58,8 +57,52 @@ def create_or_update_bet_list():
         SessionKey.CREATE_UPDATE_BET_LIST_ACTION.update(action)
     return bet_list_to_cu
 
+def display_match_search():
+    if not SessionKey.SEARCHED_MATCHES.is_in_session():
+        SessionKey.SEARCHED_MATCHES.update([])
+    search_text = st.text_input(
+        'Search a match, a team or a competition',
+        placeholder='e.g. atletico, psg marseille'
+    )
+    if search_text:
+        df_found_matches = search_matches(search_text)
+        selection = st.dataframe(
+            df_found_matches,
+            column_config={
+                "odd_match_code": None,
+                "rank": None,
+                "match_date": st.column_config.DatetimeColumn("Date", format="DD-MM-YYYY HH:mm")
+            },
+            on_select="rerun",
+            selection_mode="multi-row",
+            hide_index=True,
+            key='match_search_results'
+        )
+        ls_selected_rows = selection.selection.rows
+        if st.button('Add selected matches to the bet list', disabled=not ls_selected_rows):
+            ls_found_match_codes = df_found_matches.iloc[ls_selected_rows].odd_match_code.to_list()
+            SessionKey.SEARCHED_MATCHES.update(
+                list(dict.fromkeys(SessionKey.SEARCHED_MATCHES.get() + ls_found_match_codes))
+            )
+    return SessionKey.SEARCHED_MATCHES.get()
+
 def display_df_program(ls_selected=None):
-    df_program = get_program()
+    with_margins = st.toggle(
+        'Show implied probabilities, fair odds and bookmaker margins',
+        key='program_with_margins'
+    )
+    with_team_form = st.toggle(
+        'Show the form of both teams over their last matches',
+        key='program_with_team_form'
+    )
+    df_program = get_program(with_margins=with_margins)
+    if with_team_form:
+        df_program = df_program.merge(
+            get_program_team_form(),
+            on='odd_match_code',
+            how='left',
+            validate='1:1'
+        )
     if ls_selected:
         data = (
             df_program
@@ -86,111 +129,47 @@ def display_df_program(ls_selected=None):
                 disabled=True
             )
         },
-        disabled=[
-                'match_date', 'competition', 'description', 
-                '1', 'X', '2', 
-                '1X', 'X2', '12', 
-                '- 0.5 go.', '+ 0.5 go.', 
-                '- 1.5 go.', '+ 1.5 go.',
-                '- 2.5 go.', '+ 2.5 go.',
-                '- 3.5 go.', '+ 3.5 go.', 
-                '- 4.5 go.', '+ 4.5 go.',
-                '- 5.5 go.', '+ 5.5 go.',
-                'odd_match_code'
-        ],
+        disabled=df_program.columns.to_list(),
         column_order=['select_match', *df_program.columns.to_list()],
         hide_index=True
     )
 
-@st.fragment
 def display_new_bet_list_form(bet_list_name, df_program_matches, df_previous_bet_list_odds):
-    LS_ORDERED_ODDS = [
-        '1', 'X', '2', 
-        '1X', 'X2', '12', 
-        '- 0.5 go.', '+ 0.5 go.', 
-        '- 1.5 go.', '+ 1.5 go.',
-        '- 2.5 go.', '+ 2.5 go.',
-        '- 3.5 go.', '+ 3.5 go.', 
-        '- 4.5 go.', '+ 4.5 go.',
-        '- 5.5 go.', '+ 5.5 go.',
-    ]
-    df_odds = get_odds_table()
     selected_matches = (
         df_program_matches
         .query(
             'select_match == True'
         )
     )
+    dc_odds_cards = get_match_odds_cards(tuple(selected_matches.odd_match_code.to_list()))
     if selected_matches.shape[0] < 3:
         st.warning('A bet list should contain at least 3 odds')
-    for match in selected_matches.itertuples():
-        df_raw_match_odds = get_odds_for_match(match, df_odds)
-        df_match_odds = (
-            df_raw_match_odds
-            .pivot(
-                values="odd_value",
-                columns="odd_name",
-                index="odd_match_code"
-            )
-            .reset_index(drop=False)
-            .rename_axis(None, axis=1)
-            .drop(columns='odd_match_code')
-        )
-        if (
-            df_previous_bet_list_odds is not None and
-            match.odd_match_code in df_previous_bet_list_odds.odd_match_code.to_list()
-        ):
-            df_match_odds = display_previous_odd(match, df_match_odds, df_previous_bet_list_odds)
-        with st.container(border=True):
-            st.markdown(f'##### {match.description}')
-            match_info_col1, match_info_col2 = st.columns(2)
-            match_info_col1.write(match.competition)
-            match_info_col2.write(
-                (
-                    match.match_date.strftime(r'%d/%m/%Y %H:%M')
-                )
-            )
-            dataframe_columns = [col for col in LS_ORDERED_ODDS if col in df_match_odds.columns]
-            selection = st.dataframe(
-                data=df_match_odds[dataframe_columns],
-                on_select="rerun",
-                selection_mode=["single-column"]
-            )
-            
-            if len(selection.selection.columns) == 1:
-                odd_name = selection.selection.columns[0]
-                odd_full_data = (
-                    df_raw_match_odds
-                    .query('odd_name == @odd_name')
-                    .to_dict(orient="records")
-                    [0]
-                )
-                odd_dict = {
-                    "match_description":match.description,
-                    "match_datetime":match.match_date,
-                    "competition":match.competition,
-                } | odd_full_data
-                update_bet_list_odd_in_session(match, odd_dict)
+    cards_container = st.container()
     st.subheader('Summary')
-    bet_amount = st.number_input(
+    summary_placeholder = st.empty()
+    display_bet_list_checkout(bet_list_name, df_previous_bet_list_odds, summary_placeholder)
+    with cards_container:
+        for match in selected_matches.itertuples():
+            display_match_odds_card(
+                match,
+                dc_odds_cards[match.odd_match_code],
+                df_previous_bet_list_odds,
+                summary_placeholder
+            )
+
+@st.fragment
+def display_bet_list_checkout(bet_list_name, df_previous_bet_list_odds, summary_placeholder):
+    # Bet amount, system bets and save: their widgets only rerun this fragment,
+    # not the program editor and the odds cards.
+    st.number_input(
         'Bet amount',
         min_value=10,
         value=10,
-        step=5
+        step=5,
+        key='bet_list_bet_amount'
     )
-    new_bet_list_matches = SessionKey.NEW_BET_LIST_MATCHES.get().values()
-    if SessionKey.CREATE_UPDATE_BET_LIST_ACTION.get() == CREATE_UPDATE_BET_LIST_ACTION.CREATE:
-        display_summary(new_bet_list_matches, bet_amount)
-    elif SessionKey.CREATE_UPDATE_BET_LIST_ACTION.get() == CREATE_UPDATE_BET_LIST_ACTION.UPDATE:
-        new_bet_list_tab, old_bet_list_tab = st.tabs(["New Bet List", "Old Bet List"])
-        with new_bet_list_tab:
-            display_summary(new_bet_list_matches, bet_amount)
-        with old_bet_list_tab:
-            odd_keys = df_previous_bet_list_odds.key.to_list()
-            existing_bet_list_matches = get_existing_bet_list_summary(odd_keys)
-            display_summary(existing_bet_list_matches, bet_amount)
-            
-
+    display_bet_list_summary(df_previous_bet_list_odds, summary_placeholder)
+    display_system_bets(bet_list_name)
 
     form_submited = st.button('Save bet list')
 
@@ -200,10 +179,124 @@ def display_new_bet_list_form(bet_list_name, df_program_matches, df_previous_bet
             for match_code, odd_dict in SessionKey.NEW_BET_LIST_MATCHES.get().items()
         ]
         upsert_bet_list(bet_list_name, bet_list_odds)
+        SessionKey.SEARCHED_MATCHES.update([])
         st.switch_page('bet_lists/search_bet_lists.py')
 
     
 
+@st.fragment
+def display_match_odds_card(match, odds_card, df_previous_bet_list_odds, summary_placeholder):
+    # Reruns on its own when one of its odds is picked, then only redraws the
+    # summary (no widgets) in the placeholder shared with the other cards.
+    df_match_odds = odds_card["df_odds"]
+    if (
+        df_previous_bet_list_odds is not None and
+        match.odd_match_code in df_previous_bet_list_odds.odd_match_code.to_list()
+    ):
+        df_match_odds = display_previous_odd(match, df_match_odds, df_previous_bet_list_odds)
+    with st.container(border=True):
+        st.markdown(f'##### {match.description}')
+        match_info_col1, match_info_col2 = st.columns(2)
+        match_info_col1.write(match.competition)
+        match_info_col2.write(
+            (
+                match.match_date.strftime(r'%d/%m/%Y %H:%M')
+            )
+        )
+        selection = st.dataframe(
+            data=df_match_odds,
+            column_order=odds_card["odd_names"],
+            on_select="rerun",
+            selection_mode=["single-column"],
+            key=f'odds_card_{match.odd_match_code}'
+        )
+
+    if len(selection.selection.columns) == 1:
+        odd_name = selection.selection.columns[0]
+        odd_dict = {
+            "match_description":match.description,
+            "match_datetime":match.match_date,
+            "competition":match.competition,
+        } | odds_card["dc_odds"][odd_name]
+        previous_odd_dict = SessionKey.NEW_BET_LIST_MATCHES.get().get(match.odd_match_code)
+        if previous_odd_dict is None or previous_odd_dict["key"] != odd_dict["key"]:
+            update_bet_list_odd_in_session(match, odd_dict)
+            # System bets are drawn outside this card: rerun the app when their
+            # pool is shown or just got big enough to be offered
+            if st.session_state.get('show_system_bets') or (
+                previous_odd_dict is None and
+                get_system_bets_pool().shape[0] == SYSTEM_BETS_MIN_POOL_SIZE
+            ):
+                st.rerun(scope="app")
+            display_bet_list_summary(df_previous_bet_list_odds, summary_placeholder)
+
+def display_bet_list_summary(df_previous_bet_list_odds, summary_placeholder):
+    bet_amount = st.session_state['bet_list_bet_amount']
+    new_bet_list_matches = SessionKey.NEW_BET_LIST_MATCHES.get().values()
+    with summary_placeholder.container():
+        if SessionKey.CREATE_UPDATE_BET_LIST_ACTION.get() == CREATE_UPDATE_BET_LIST_ACTION.CREATE:
+            display_summary(new_bet_list_matches, bet_amount)
+        elif SessionKey.CREATE_UPDATE_BET_LIST_ACTION.get() == CREATE_UPDATE_BET_LIST_ACTION.UPDATE:
+            new_bet_list_tab, old_bet_list_tab = st.tabs(["New Bet List", "Old Bet List"])
+            with new_bet_list_tab:
+                display_summary(new_bet_list_matches, bet_amount)
+            with old_bet_list_tab:
+                odd_keys = df_previous_bet_list_odds.key.to_list()
+                existing_bet_list_matches = get_existing_bet_list_summary(odd_keys)
+                display_summary(existing_bet_list_matches, bet_amount)
+
+def get_system_bets_pool():
+    return pd.DataFrame(
+        [
+            {"odd_match_code":match_code} | odd_dict
+            for match_code, odd_dict in SessionKey.NEW_BET_LIST_MATCHES.get().items()
+            if odd_dict
+        ]
+    )
+
+@st.fragment
+def display_system_bets(bet_list_name):
+    # Reads its pool from the session on every run, the odds cards rerun the
+    # app when they change the pool while it is shown.
+    df_pool = get_system_bets_pool()
+    if df_pool.shape[0] < SYSTEM_BETS_MIN_POOL_SIZE:
+        return
+    if not st.toggle('System bets', key='show_system_bets'):
+        return
+    with st.container(border=True):
+        size_col, top_n_col, rank_by_col = st.columns(3)
+        combination_size = size_col.number_input(
+            'Odds per combination',
+            min_value=2,
+            max_value=df_pool.shape[0],
+            value=df_pool.shape[0] - 1
+        )
+        top_n = top_n_col.number_input('Best combinations', min_value=1, value=20)
+        rank_by = rank_by_col.selectbox(
+            'Rank by',
+            [
+                ranking for ranking in SYSTEM_BET_RANKINGS
+                if ranking != "expected_value" or "probability" in df_pool.columns
+            ],
+            help='Ranking by expected value needs a probability estimate for each odd, '
+                 'bet list odds carry none'
+        )
+        df_combinations = get_top_system_bet_combinations(
+            df_pool, combination_size, top_n=top_n, rank_by=rank_by
+        )
+        selection = st.dataframe(
+            df_combinations,
+            column_config={"positions": None},
+            on_select="rerun",
+            selection_mode="multi-row"
+        )
+        ls_selected_rows = selection.selection.rows
+        if st.button('Save selected combinations', disabled=not (ls_selected_rows and bet_list_name)):
+            ls_saved_names = save_system_bet_combinations(
+                bet_list_name, df_pool, df_combinations.iloc[ls_selected_rows]
+            )
+            st.success(f'{len(ls_saved_names)} bet list(s) saved: {", ".join(ls_saved_names)}')
+
 def color_previous_odd(dat, c='silver'):
     return [f'background-color: {c}' for i in dat]
 
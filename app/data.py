@@ -1,15 +1,34 @@
 
 import datetime as dt
+import io
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import functools
+import gzip
+import hashlib
+import json
 from typing import Optional
 import os
 import pathlib
+import re
 import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+import warnings
+import zlib
 
 import requests as rq
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import sqlalchemy
 from sqlalchemy import create_engine, MetaData, event
-from sqlalchemy import ForeignKey, select, text, JSON
+from sqlalchemy import ForeignKey, Index, bindparam, insert, select, text, JSON
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm  import (
     declarative_base,
     Mapped,
@@ -23,36 +42,328 @@ from app_session import SessionKey
 
 #region DB engines
 
-IN_MEMORY_SQLALCHEMY_DB_ENGINE = create_engine('sqlite://')
+# In the browser /mnt is persisted to IndexedDB by stlite (see index.html), so
+# the sporacle DB survives between visits and only needs a delta sync.
+SPORACLE_DB_PATH = "/mnt/database.db" if sys.platform == "emscripten" else "database.db"
+LOCAL_DB_PATH = "local.database.db"
+
+# The sporacle DB is only written while no pooled engine is open (see
+# reset_engines), so it can be opened immutable (no locking, no change detection).
+SPORACLE_DB_URI = f"file:{SPORACLE_DB_PATH}?immutable=1"
+
+SPORACLE_DB_PRAGMAS = {
+    "cache_size": -32000,
+    "mmap_size": 268435456,
+}
+LOCAL_DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -8000,
+}
+
+DB_FILE_CHUNK_SIZE = 1024 * 1024
+SQLITE_FILE_HEADER = b"SQLite format 3\x00"
+GZIP_FILE_HEADER = b"\x1f\x8b"
+
+# Deltas are only downloaded while they weigh less than this share of the full DB
+MAX_DELTA_SIZE_RATIO = 0.5
+# Errors raised by a corrupted, malformed or out of sync delta
+SPORACLE_DELTA_ERRORS = (
+    ValueError,
+    KeyError,
+    OSError,
+    EOFError,
+    zlib.error,
+    sqlite3.Error,
+    sqlalchemy.exc.SQLAlchemyError,
+)
+
+# Per-connection prepared statement cache of the sqlite3 driver
+SQLITE_CACHED_STATEMENTS = 256
+
+_ENGINE_REGISTRY: dict[str, sqlalchemy.Engine] = {}
+
+
+def apply_pragmas(dbapi_connection, pragmas, schema=None):
+    prefix = f"{schema}." if schema else ""
+    cursor_obj = dbapi_connection.cursor()
+    for pragma_name, pragma_value in pragmas.items():
+        cursor_obj.execute(f"PRAGMA {prefix}{pragma_name}={pragma_value};")
+    cursor_obj.close()
+
+
+def get_pooled_engine(db_name, url, pragmas):
+    if db_name not in _ENGINE_REGISTRY:
+        engine = create_engine(
+            url,
+            connect_args={"cached_statements": SQLITE_CACHED_STATEMENTS}
+        )
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+        _ENGINE_REGISTRY[db_name] = engine
+    return _ENGINE_REGISTRY[db_name]
+
+
+def reset_engines():
+    # Must be called before database.db / local.database.db are swapped on disk:
+    # pooled connections keep the old files (and their ATTACHes) open.
+    for engine in _ENGINE_REGISTRY.values():
+        engine.dispose()
+    _ENGINE_REGISTRY.clear()
+    IN_MEMORY_SQLALCHEMY_DB_ENGINE.dispose()
+
+
+IN_MEMORY_SQLALCHEMY_DB_ENGINE = create_engine(
+    'sqlite://',
+    creator=lambda: sqlite3.connect(
+        "file::memory:",
+        uri=True,
+        cached_statements=SQLITE_CACHED_STATEMENTS
+    ),
+)
 
 def get_sqlite_local_db_engine():
     # return sqlite3.connect("file::memory:?cache=shared", uri=True)
-    return sqlite3.connect("local.database.db")
+    return sqlite3.connect(LOCAL_DB_PATH)
 
 def get_sqlalchemy_local_db_engine():
-    return sqlalchemy.create_engine("sqlite:///local.database.db")
+    return get_pooled_engine(
+        db_name="local_db",
+        url=f"sqlite:///{LOCAL_DB_PATH}",
+        pragmas=LOCAL_DB_PRAGMAS
+    )
 
 def get_sqlite_sporacle_db_engine():
-    return sqlite3.connect("database.db")
+    return sqlite3.connect(SPORACLE_DB_URI, uri=True)
 
 def get_sqlalchemy_sporacle_engine():
-    return sqlalchemy.create_engine("sqlite:///database.db")
+    return get_pooled_engine(
+        db_name="sporacle_db",
+        url=f"sqlite:///{SPORACLE_DB_URI}&uri=true",
+        pragmas=SPORACLE_DB_PRAGMAS
+    )
 
-def get_sqlalchemy_cross_database_engine():
+def get_sporacle_build_engine():
+    # Writable handle on database.db, only used while the freshly downloaded
+    # file is prepared, before the immutable pooled engines read it.
     engine = create_engine('sqlite://')
-    with engine.connect() as connection:
-        _ = connection.execute(text("attach 'database.db' as sporacle_db;"))
-        _ = connection.execute(text("attach 'local.database.db' as app_db;"))
-    Session = sessionmaker(bind=engine)
+
+    @event.listens_for(engine, "connect")
+    def attach_sporacle_db(dbapi_connection, connection_record):
+        cursor_obj = dbapi_connection.cursor()
+        cursor_obj.execute(f"attach '{SPORACLE_DB_PATH}' as sporacle_db;")
+        cursor_obj.close()
+
+    return engine
+
+def get_local_db_file_engine(db_path):
+    # Same attach layout as the in-memory engine with app_db pointing at
+    # db_path, used to migrate an uploaded file before it replaces the local DB.
+    engine = create_engine(
+        'sqlite://',
+        creator=lambda: sqlite3.connect("file::memory:", uri=True)
+    )
+
+    @event.listens_for(engine, "connect")
+    def attach_databases(dbapi_connection, connection_record):
+        cursor_obj = dbapi_connection.cursor()
+        cursor_obj.execute(f"attach '{SPORACLE_DB_URI}' as sporacle_db;")
+        cursor_obj.execute(f"attach '{db_path}' as app_db;")
+        cursor_obj.close()
+
+    return engine
+
+def get_sqlalchemy_cross_database_engine():
+    Session = sessionmaker(bind=IN_MEMORY_SQLALCHEMY_DB_ENGINE)
     session = Session()
     return session
 
 @event.listens_for(IN_MEMORY_SQLALCHEMY_DB_ENGINE, "connect", insert=True)
 def set_current_schema(dbapi_connection, connection_record):
+    # Runs once per pooled connection, not once per query.
     cursor_obj = dbapi_connection.cursor()
-    cursor_obj.execute("attach 'database.db' as sporacle_db;")
-    cursor_obj.execute("attach 'local.database.db' as app_db;")
+    cursor_obj.execute(f"attach '{SPORACLE_DB_URI}' as sporacle_db;")
+    cursor_obj.execute(f"attach '{LOCAL_DB_PATH}' as app_db;")
     cursor_obj.close()
+    apply_pragmas(dbapi_connection, SPORACLE_DB_PRAGMAS, schema="sporacle_db")
+    apply_pragmas(dbapi_connection, LOCAL_DB_PRAGMAS, schema="app_db")
+
+
+#endregion
+
+#region Result cache
+
+RESULT_CACHE_MAX_ENTRIES = 32
+# Estimated size of all cached results, a bigger result is not cached at all
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_RESULT_CACHE: OrderedDict = OrderedDict()
+_result_cache_size = 0
+_RESULT_CACHE_LOCK = threading.Lock()
+_result_cache_generation = 0
+
+
+def get_file_version(path):
+    try:
+        file_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def get_db_version():
+    # The WAL file is part of the local DB content until it is checkpointed.
+    # Queries filter on DATE('now'), so the current date is part of the version too.
+    return (
+        _result_cache_generation,
+        dt.date.today(),
+        get_file_version(SPORACLE_DB_PATH),
+        get_file_version(LOCAL_DB_PATH),
+        get_file_version(f"{LOCAL_DB_PATH}-wal"),
+    )
+
+
+def invalidate_result_cache():
+    global _result_cache_generation, _result_cache_size
+    with _RESULT_CACHE_LOCK:
+        _result_cache_generation += 1
+        _RESULT_CACHE.clear()
+        _result_cache_size = 0
+
+
+def get_result_size(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return int(result.memory_usage(deep=True).sum())
+    if isinstance(result, dict):
+        return sys.getsizeof(result) + sum(get_result_size(value) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sys.getsizeof(result) + sum(get_result_size(value) for value in result)
+    return sys.getsizeof(result)
+
+
+def cached_result(func):
+    # LRU bounded both by entry count and by the estimated size of the results
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _result_cache_size
+        cache_key = (func.__name__, args, tuple(sorted(kwargs.items())), get_db_version())
+        with _RESULT_CACHE_LOCK:
+            if cache_key in _RESULT_CACHE:
+                _RESULT_CACHE.move_to_end(cache_key)
+                return _RESULT_CACHE[cache_key][0].copy()
+        result = func(*args, **kwargs)
+        result_size = get_result_size(result)
+        if result_size > RESULT_CACHE_MAX_BYTES:
+            return result
+        with _RESULT_CACHE_LOCK:
+            if cache_key in _RESULT_CACHE:
+                _result_cache_size -= _RESULT_CACHE.pop(cache_key)[1]
+            _RESULT_CACHE[cache_key] = (result, result_size)
+            _result_cache_size += result_size
+            while (
+                len(_RESULT_CACHE) > RESULT_CACHE_MAX_ENTRIES
+                or _result_cache_size > RESULT_CACHE_MAX_BYTES
+            ):
+                _result_cache_size -= _RESULT_CACHE.popitem(last=False)[1][1]
+        return result.copy()
+    return wrapper
+
+
+#endregion
+
+#region Instrumentation
+
+PROFILING_BUFFER_SIZE = 500
+
+_PROFILING_RECORDS: deque = deque(maxlen=PROFILING_BUFFER_SIZE)
+_profiling_enabled = os.environ.get("SPORACLE_PROFILING") == "1"
+
+
+def enable_profiling(is_enabled=True):
+    global _profiling_enabled
+    _profiling_enabled = is_enabled
+
+
+def is_profiling_enabled():
+    return _profiling_enabled
+
+
+def record_timing(kind, name, wall_time, **details):
+    _PROFILING_RECORDS.append(
+        {
+            "kind": kind,
+            "name": name,
+            "started_at": dt.datetime.now() - dt.timedelta(seconds=wall_time),
+            "wall_time": wall_time,
+            "sql": details.get("sql"),
+            "params": details.get("params"),
+            "row_count": details.get("row_count"),
+            "build_time": details.get("build_time"),
+        }
+    )
+
+
+@contextlib.contextmanager
+def profile_section(kind, name):
+    if not _profiling_enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(kind, name, time.perf_counter() - start)
+
+
+def profiled(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profiling_enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        record_timing(
+            "function",
+            func.__name__,
+            time.perf_counter() - start,
+            row_count=len(result) if hasattr(result, "__len__") else None
+        )
+        return result
+    return wrapper
+
+
+def get_profiling_records():
+    return pd.DataFrame(
+        list(_PROFILING_RECORDS),
+        columns=[
+            "kind", "name", "started_at", "wall_time",
+            "sql", "params", "row_count", "build_time"
+        ]
+    )
+
+
+def get_profiling_summary(df_records):
+    return (
+        df_records
+        .groupby(["kind", "name"])
+        ["wall_time"]
+        .agg(
+            calls="count",
+            p50=lambda s_: s_.quantile(0.5),
+            p90=lambda s_: s_.quantile(0.9),
+            p99=lambda s_: s_.quantile(0.99),
+            max="max",
+        )
+        .sort_values("p90", ascending=False)
+        .reset_index()
+    )
+
+
+def clear_profiling_records():
+    _PROFILING_RECORDS.clear()
 
 
 #endregion
@@ -65,7 +376,10 @@ Base = declarative_base()
 class BetList(Base):
 
     __tablename__ = "bet_lists"
-    __table_args__ = {"schema": "app_db"}
+    __table_args__ = (
+        Index("ix_bet_lists_last_match_date", "last_match_date"),
+        {"schema": "app_db"},
+    )
 
 
     bet_list_name: Mapped[str] = mapped_column(primary_key=True)
@@ -78,10 +392,69 @@ class BetList(Base):
     earliest_match_date: Mapped[Optional[dt.datetime]]
     last_match_date: Mapped[Optional[dt.datetime]]
 
+    odd_entries: Mapped[list["BetListOdd"]] = relationship(
+        back_populates="bet_list",
+        cascade="all, delete-orphan",
+        order_by="BetListOdd.position"
+    )
+    settlement: Mapped[Optional["BetListSettlement"]] = relationship(
+        back_populates="bet_list",
+        cascade="all, delete-orphan"
+    )
+
+
+class BetListOdd(Base):
+    __tablename__ = "bet_list_odds"
+    __table_args__ = (
+        Index("ix_bet_list_odds_key", "key"),
+        Index("ix_bet_list_odds_odd_match_code", "odd_match_code"),
+        {"schema": "app_db"},
+    )
+
+    bet_list_name: Mapped[str] = mapped_column(
+        ForeignKey("app_db.bet_lists.bet_list_name"),
+        primary_key=True
+    )
+    position: Mapped[int] = mapped_column(primary_key=True)
+    key: Mapped[str]
+    odd_match_code: Mapped[Optional[int]]
+
+    bet_list: Mapped["BetList"] = relationship(back_populates="odd_entries")
+
+
+class BetListSettlement(Base):
+    __tablename__ = "bet_list_settlements"
+    __table_args__ = (
+        # Pages of SETTLED_BET_LISTS_QUERY are read in index order
+        Index(
+            "ix_bet_list_settlements_is_winning_settlement_date",
+            "is_winning", text("settlement_date DESC"), "bet_list_name"
+        ),
+        {"schema": "app_db"},
+    )
+
+    bet_list_name: Mapped[str] = mapped_column(
+        ForeignKey("app_db.bet_lists.bet_list_name"),
+        primary_key=True
+    )
+    is_winning: Mapped[bool]
+    odds_product: Mapped[float]
+    match_count: Mapped[int]
+    losing_match_count: Mapped[int]
+    settlement_date: Mapped[dt.datetime]
+
+    bet_list: Mapped["BetList"] = relationship(back_populates="settlement")
+
 
 class Odd(Base):
     __tablename__ = "odds"
-    __table_args__ = {"schema": "sporacle_db"}
+    __table_args__ = (
+        Index(
+            "ix_odds_odd_match_code_odd_name_odd_value",
+            "odd_match_code", "odd_name", "odd_value"
+        ),
+        {"schema": "sporacle_db"},
+    )
 
     key: Mapped[str] = mapped_column(primary_key=True)
     odd_name: Mapped[str]
@@ -98,7 +471,11 @@ class Odd(Base):
 
 class Match(Base):
     __tablename__ = "matches"
-    __table_args__ = {"schema": "sporacle_db"}
+    __table_args__ = (
+        Index("ix_matches_match_date_odd_match_code", "match_date", "odd_match_code"),
+        Index("ix_matches_competition_code", "competition_code"),
+        {"schema": "sporacle_db"},
+    )
 
     odd_match_code: Mapped[int] = mapped_column(primary_key=True)
     competition_code: Mapped[int] = mapped_column(
@@ -138,128 +515,1134 @@ def create_all_tables():
     Base.metadata.create_all(IN_MEMORY_SQLALCHEMY_DB_ENGINE)
 
 
+# Bumped whenever the local DB layout changes, stored in PRAGMA user_version
+LOCAL_DB_SCHEMA_VERSION = 1
+
+LOCAL_DB_MIGRATIONS = {
+    # 0 -> 1: bet list odd keys move from the bet_lists.odds JSON array
+    # to the bet_list_odds junction table
+    1: """
+    INSERT INTO app_db.bet_list_odds (bet_list_name, position, key, odd_match_code)
+    SELECT
+        bet_lists.bet_list_name,
+        odd_keys.key as position,
+        odd_keys.value as key,
+        odds.odd_match_code
+    FROM app_db.bet_lists as bet_lists
+    JOIN json_each(bet_lists.odds) as odd_keys
+    LEFT JOIN sporacle_db.odds as odds ON odds.key = odd_keys.value
+    WHERE bet_lists.bet_list_name NOT IN (
+        SELECT bet_list_name FROM app_db.bet_list_odds
+    )
+    """,
+}
+
+
+LOCAL_DB_TABLES = [
+    BetList.__table__,
+    BetListOdd.__table__,
+    BetListSettlement.__table__,
+]
+
+def migrate_local_db(engine=IN_MEMORY_SQLALCHEMY_DB_ENGINE):
+    with engine.begin() as connection:
+        # create_all() skips the indexes of tables that already exist
+        for table in LOCAL_DB_TABLES:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        schema_version = connection.execute(
+            text("PRAGMA app_db.user_version;")
+        ).scalar()
+        for version in range(schema_version + 1, LOCAL_DB_SCHEMA_VERSION + 1):
+            connection.execute(text(LOCAL_DB_MIGRATIONS[version]))
+        if schema_version < LOCAL_DB_SCHEMA_VERSION:
+            connection.execute(
+                text(f"PRAGMA app_db.user_version = {LOCAL_DB_SCHEMA_VERSION};")
+            )
+
+
 #endregion
 
 #region DB management
+def create_sporacle_indexes():
+    engine = get_sporacle_build_engine()
+    with engine.begin() as connection:
+        for table in (Match.__table__, Odd.__table__):
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    engine.dispose()
+
+def create_program_table():
+    engine = get_sporacle_build_engine()
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS sporacle_db.program;"))
+        connection.execute(text(CREATE_PROGRAM_TABLE_QUERY))
+        connection.execute(text(
+            "CREATE INDEX sporacle_db.ix_program_match_date "
+            "ON program (match_date, odd_match_code);"
+        ))
+    engine.dispose()
+
+def update_team_form_table():
+    # Only rows of new, corrected or removed results are rewritten, the rest of
+    # the table is kept from one Sporacle DB version to the next.
+    engine = get_sporacle_build_engine()
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_TEAM_FORM_TABLE_QUERY))
+        connection.execute(text(DELETE_STALE_TEAM_FORM_QUERY))
+        connection.execute(text(INSERT_NEW_TEAM_FORM_QUERY))
+    engine.dispose()
+
+@functools.cache
+def is_fts5_available():
+    con = sqlite3.connect(":memory:")
+    try:
+        ls_compile_options = [row[0] for row in con.execute("PRAGMA compile_options;")]
+    finally:
+        con.close()
+    return "ENABLE_FTS5" in ls_compile_options
+
+def create_match_search_table():
+    if not is_fts5_available():
+        return
+    engine = get_sporacle_build_engine()
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS sporacle_db.match_search;"))
+        connection.execute(text(CREATE_MATCH_SEARCH_TABLE_QUERY))
+        connection.execute(text(INSERT_MATCH_SEARCH_QUERY))
+    engine.dispose()
+
 def init_database():
+    create_sporacle_indexes()
+    create_program_table()
+    update_team_form_table()
+    create_match_search_table()
+    # Immutable connections opened before the indexes existed would not see them
+    reset_engines()
     create_all_tables()
+    migrate_local_db()
+    for query_name, full_scans in check_query_plans().items():
+        warnings.warn(f"{query_name} runs full table scans: {full_scans}")
 
 def create_or_replace_local_db():
-    local_db_path = pathlib.Path('local.database.db')
-    if local_db_path.exists():
-        os.remove(local_db_path)
-    _ = get_sqlite_local_db_engine()
+    reset_engines()
+    invalidate_result_cache()
+    for suffix in ("", "-wal", "-shm"):
+        local_db_path = pathlib.Path(f'{LOCAL_DB_PATH}{suffix}')
+        if local_db_path.exists():
+            os.remove(local_db_path)
+    get_sqlite_local_db_engine().close()
 
 
 def attach_sporacle_db_to_local_db():
     engine = get_sqlalchemy_local_db_engine()
     with engine.connect() as con:
-        con.execute(text("ATTACH DATABASE 'database.db' AS 'odds_db';"))
+        con.execute(text(f"ATTACH DATABASE '{SPORACLE_DB_PATH}' AS 'odds_db';"))
         con.commit()
 
-def initial_app_setup(sporacle_bytes_data):
-    with open("database.db", 'wb') as f:
-        f.write(sporacle_bytes_data)
-    _ = get_sqlite_sporacle_db_engine()
+def export_local_db(export_path, compress=False):
+    # VACUUM INTO copies the live pages (WAL included) from a single read
+    # transaction: the snapshot is consistent and carries no free pages.
+    export_path = pathlib.Path(export_path)
+    snapshot_path = export_path.with_name(f"{export_path.name}.snapshot")
+    snapshot_path.unlink(missing_ok=True)
+    con = get_sqlite_local_db_engine()
+    try:
+        con.execute("VACUUM INTO ?;", (str(snapshot_path),))
+    finally:
+        con.close()
+    if not compress:
+        os.replace(snapshot_path, export_path)
+        return export_path
+    with open(snapshot_path, 'rb') as f_in, gzip.open(export_path, 'wb') as f_out:
+        while chunk := f_in.read(DB_FILE_CHUNK_SIZE):
+            f_out.write(chunk)
+    os.remove(snapshot_path)
+    return export_path
+
+def get_sporacle_db_version():
+    if not pathlib.Path(SPORACLE_DB_PATH).exists():
+        return None
+    con = get_sqlite_sporacle_db_engine()
+    try:
+        row = con.execute("SELECT version FROM db_version").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    con.close()
+    return row[0] if row else None
+
+def get_delta_chain(manifest, current_version):
+    # Returns the delta paths to download, or None when a full download is cheaper
+    # or the local copy is too far behind the published deltas.
+    if current_version is None or manifest.get("version") is None:
+        return None
+    dc_deltas = {delta["from_version"]: delta for delta in manifest["deltas"]}
+    ls_deltas = []
+    version = current_version
+    while version != manifest["version"]:
+        if version not in dc_deltas or len(ls_deltas) >= len(dc_deltas):
+            return None
+        ls_deltas.append(dc_deltas[version])
+        version = dc_deltas[version]["to_version"]
+    deltas_size = sum(delta["size"] for delta in ls_deltas)
+    full_size = manifest.get("database_gz_size", manifest.get("database_size", 0))
+    if deltas_size > full_size * MAX_DELTA_SIZE_RATIO:
+        return None
+    return [delta["path"] for delta in ls_deltas]
+
+SPORACLE_DELTA_KEYS = {"from_version", "to_version", "tables"}
+SPORACLE_TABLE_DELTA_KEYS = {"primary_key", "columns", "upserts", "deletes"}
+
+def read_sporacle_delta(delta_bytes):
+    delta = json.loads(gzip.decompress(delta_bytes))
+    if not isinstance(delta, dict) or not SPORACLE_DELTA_KEYS <= delta.keys():
+        raise ValueError(
+            f"A delta should be an object with {', '.join(sorted(SPORACLE_DELTA_KEYS))}"
+        )
+    if not isinstance(delta["tables"], dict) or not all(
+        isinstance(table_delta, dict) and SPORACLE_TABLE_DELTA_KEYS <= table_delta.keys()
+        for table_delta in delta["tables"].values()
+    ):
+        raise ValueError(
+            f"Each table delta should be an object with "
+            f"{', '.join(sorted(SPORACLE_TABLE_DELTA_KEYS))}"
+        )
+    return delta
+
+def apply_sporacle_delta(delta_bytes):
+    delta = read_sporacle_delta(delta_bytes)
+    current_version = get_sporacle_db_version()
+    if current_version != delta["from_version"]:
+        raise ValueError(
+            f"Delta {delta['from_version']} -> {delta['to_version']} "
+            f"cannot be applied to version {current_version}"
+        )
+    engine = get_sporacle_build_engine()
+    with engine.begin() as connection:
+        for table_name, table_delta in delta["tables"].items():
+            primary_key = table_delta["primary_key"]
+            columns = ", ".join(f'"{col}"' for col in table_delta["columns"])
+            placeholders = ", ".join("?" for _ in table_delta["columns"])
+            if table_delta["deletes"]:
+                connection.exec_driver_sql(
+                    f'DELETE FROM sporacle_db."{table_name}" '
+                    f'WHERE "{primary_key}" IN (SELECT value FROM json_each(?))',
+                    (json.dumps(table_delta["deletes"]),)
+                )
+            if table_delta["upserts"]:
+                connection.exec_driver_sql(
+                    f'INSERT OR REPLACE INTO sporacle_db."{table_name}" ({columns}) '
+                    f'VALUES ({placeholders})',
+                    [tuple(row) for row in table_delta["upserts"]]
+                )
+        connection.exec_driver_sql(
+            "UPDATE sporacle_db.db_version SET version = ?",
+            (delta["to_version"],)
+        )
+    engine.dispose()
+
+def setup_app_databases():
     create_or_replace_local_db()
-    create_all_tables()
+    init_database()
     SessionKey.SPORACLE_DB_DOWNLOADED.update(True)
     SessionKey.LOCAL_DB_INITIALIZED.update(True)
 
+def initial_app_setup(sporacle_bytes_data):
+    reset_engines()
+    invalidate_result_cache()
+    with open(SPORACLE_DB_PATH, 'wb') as f:
+        f.write(sporacle_bytes_data)
+    setup_app_databases()
+
+async def write_compressed_sporacle_db(compressed_chunks, expected_sha256):
+    # Gzip chunks are inflated straight to disk, the whole DB is never held in memory
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    sha256 = hashlib.sha256()
+    part_path = pathlib.Path(f"{SPORACLE_DB_PATH}.part")
+    try:
+        with open(part_path, 'wb') as f:
+            async for compressed_chunk in compressed_chunks:
+                chunk = decompressor.decompress(compressed_chunk)
+                sha256.update(chunk)
+                f.write(chunk)
+            chunk = decompressor.flush()
+            sha256.update(chunk)
+            f.write(chunk)
+        if not decompressor.eof or sha256.hexdigest() != expected_sha256:
+            raise ValueError("The downloaded sporacle DB does not match its checksum")
+        os.replace(part_path, SPORACLE_DB_PATH)
+    finally:
+        part_path.unlink(missing_ok=True)
+
+async def initial_app_setup_from_stream(compressed_chunks, expected_sha256):
+    reset_engines()
+    invalidate_result_cache()
+    await write_compressed_sporacle_db(compressed_chunks, expected_sha256)
+    setup_app_databases()
+
+def delta_app_setup(ls_sporacle_deltas):
+    reset_engines()
+    invalidate_result_cache()
+    for delta_bytes in ls_sporacle_deltas:
+        apply_sporacle_delta(delta_bytes)
+    setup_app_databases()
+
+async def delta_app_setup_or_fallback(ls_sporacle_deltas, full_app_setup):
+    # A delta that cannot be read or applied is not fatal: the full DB is
+    # downloaded instead (full_app_setup is awaited without arguments).
+    try:
+        delta_app_setup(ls_sporacle_deltas)
+    except SPORACLE_DELTA_ERRORS:
+        await full_app_setup()
+
+def write_uploaded_file(uploaded_file, file_path):
+    # Compressed exports (see export_local_db) are inflated on the fly
+    uploaded_file.seek(0)
+    is_gzip = uploaded_file.read(len(GZIP_FILE_HEADER)) == GZIP_FILE_HEADER
+    uploaded_file.seek(0)
+    f_in = gzip.GzipFile(fileobj=uploaded_file) if is_gzip else uploaded_file
+    with open(file_path, 'wb') as f:
+        try:
+            while chunk := f_in.read(DB_FILE_CHUNK_SIZE):
+                f.write(chunk)
+        except (gzip.BadGzipFile, EOFError, zlib.error) as e:
+            raise ValueError(f"The uploaded file is not a valid gzip archive: {e}") from e
+
+def check_local_db_file(db_path):
+    with open(db_path, 'rb') as f:
+        if f.read(len(SQLITE_FILE_HEADER)) != SQLITE_FILE_HEADER:
+            raise ValueError("The uploaded file is not a SQLite database")
+    con = sqlite3.connect(db_path)
+    try:
+        ls_check_errors = [row[0] for row in con.execute("PRAGMA quick_check;")]
+        schema_version = con.execute("PRAGMA user_version;").fetchone()[0]
+        ls_bet_list_columns = [
+            row[1] for row in con.execute(f"PRAGMA table_info({BetList.__tablename__});")
+        ]
+    finally:
+        con.close()
+    if ls_check_errors != ["ok"]:
+        raise ValueError(
+            f"The uploaded database is corrupted: {'; '.join(ls_check_errors[:5])}"
+        )
+    if schema_version > LOCAL_DB_SCHEMA_VERSION:
+        raise ValueError(
+            f"The uploaded database has schema version {schema_version}, "
+            f"this app only knows versions up to {LOCAL_DB_SCHEMA_VERSION}"
+        )
+    missing_columns = [
+        column.name for column in BetList.__table__.columns
+        if column.name not in ls_bet_list_columns
+    ]
+    if missing_columns:
+        raise ValueError(
+            f"The uploaded database is not a local DB, {BetList.__tablename__} "
+            f"misses the columns {', '.join(missing_columns)}"
+        )
+
+def migrate_local_db_file(db_path):
+    engine = get_local_db_file_engine(db_path)
+    Base.metadata.create_all(engine, tables=LOCAL_DB_TABLES)
+    migrate_local_db(engine)
+    with engine.connect() as connection:
+        connection.execute(text("PRAGMA app_db.wal_checkpoint(TRUNCATE);"))
+    engine.dispose()
+
+def remove_db_file(db_path):
+    for suffix in ("", "-wal", "-shm"):
+        pathlib.Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+
 def add_uploaded_db_file(uploaded_db_file):
-    with open("local.database.db", 'wb') as f:
-        f.write(uploaded_db_file.getvalue())
+    # The upload is checked and migrated on its own copy, the current local DB
+    # is only replaced (atomically) once the new file is known to be usable.
+    upload_path = f'{LOCAL_DB_PATH}.upload'
+    try:
+        write_uploaded_file(uploaded_db_file, upload_path)
+        check_local_db_file(upload_path)
+        try:
+            migrate_local_db_file(upload_path)
+        except (sqlite3.Error, sqlalchemy.exc.SQLAlchemyError) as e:
+            raise ValueError(f"The uploaded database could not be migrated: {e.args[0]}") from e
+    except Exception:
+        remove_db_file(upload_path)
+        raise
+    reset_engines()
+    invalidate_result_cache()
+    for suffix in ("-wal", "-shm"):
+        pathlib.Path(f'{LOCAL_DB_PATH}{suffix}').unlink(missing_ok=True)
+    os.replace(upload_path, LOCAL_DB_PATH)
+
+#endregion
+
+#region Queries
+PROGRAM_ODDS_COLUMNS = [
+    '1', 'X', '2',
+    '1X', 'X2', '12',
+    '- 0.5 go.', '+ 0.5 go.',
+    '- 1.5 go.', '+ 1.5 go.',
+    '- 2.5 go.', '+ 2.5 go.',
+    '- 3.5 go.', '+ 3.5 go.',
+    '- 4.5 go.', '+ 4.5 go.',
+    '- 5.5 go.', '+ 5.5 go.',
+]
+
+# Markets whose outcomes share one book, with the probability they should add
+# up to without margin: double chance outcomes each cover two 1X2 outcomes.
+PROGRAM_MARKET_GROUPS = {
+    "1X2": (['1', 'X', '2'], 1.0),
+    "double chance": (['1X', 'X2', '12'], 2.0),
+    **{
+        f"{threshold} go.": ([f'- {threshold} go.', f'+ {threshold} go.'], 1.0)
+        for threshold in ['0.5', '1.5', '2.5', '3.5', '4.5', '5.5']
+    },
+}
+
+# One row per future match, one column per market, built once per DB refresh
+CREATE_PROGRAM_TABLE_QUERY = """
+    CREATE TABLE sporacle_db.program AS
+    SELECT
+        matches.match_date as match_date,
+        competitions.name as competition,
+        matches.description as description,
+        {odds_columns},
+        matches.odd_match_code as odd_match_code,
+        matches.competition_code as competition_code
+    FROM sporacle_db.matches as matches
+    LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
+    LEFT JOIN sporacle_db.odds as odds USING (odd_match_code)
+    WHERE matches.match_date > DATE('now')
+    GROUP BY matches.odd_match_code
+""".format(
+    odds_columns=",\n        ".join(
+        f"MAX(CASE WHEN odds.odd_name = '{odd_name}' THEN odds.odd_value END) as \"{odd_name}\""
+        for odd_name in PROGRAM_ODDS_COLUMNS
+    )
+)
+
+# Rolling form of every team over its last TEAM_FORM_WINDOW finished matches,
+# one row per team and match, kept in sync with matches by update_team_form_table()
+TEAM_FORM_WINDOW = 5
+TEAM_FORM_OVER_THRESHOLDS = ['1.5', '2.5', '3.5']
+
+CREATE_TEAM_FORM_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS sporacle_db.team_form (
+        team TEXT NOT NULL,
+        match_date DATETIME NOT NULL,
+        odd_match_code INTEGER NOT NULL,
+        goals_for INTEGER NOT NULL,
+        goals_against INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        form_match_count INTEGER NOT NULL,
+        form_points INTEGER NOT NULL,
+        form_goals_for INTEGER NOT NULL,
+        form_goals_against INTEGER NOT NULL,
+        {over_rate_columns},
+        PRIMARY KEY (team, match_date, odd_match_code)
+    )
+""".format(
+    over_rate_columns=",\n        ".join(
+        f"form_over_{threshold.replace('.', '_')}_rate REAL NOT NULL"
+        for threshold in TEAM_FORM_OVER_THRESHOLDS
+    )
+)
+
+# Finished matches seen from each team
+TEAM_MATCHES_CTE = """
+    team_matches AS (
+        SELECT
+            home_team as team, match_date, odd_match_code,
+            full_time_home_goals as goals_for, full_time_away_goals as goals_against
+        FROM sporacle_db.matches
+        WHERE full_time_home_goals IS NOT NULL AND full_time_away_goals IS NOT NULL
+        UNION ALL
+        SELECT
+            away_team as team, match_date, odd_match_code,
+            full_time_away_goals as goals_for, full_time_home_goals as goals_against
+        FROM sporacle_db.matches
+        WHERE full_time_home_goals IS NOT NULL AND full_time_away_goals IS NOT NULL
+    ),
+    new_team_matches AS (
+        SELECT team_matches.*
+        FROM team_matches
+        LEFT JOIN sporacle_db.team_form as team_form USING (team, match_date, odd_match_code)
+        WHERE
+            team_form.team IS NULL
+            OR team_form.goals_for != team_matches.goals_for
+            OR team_form.goals_against != team_matches.goals_against
+    )
+"""
+
+# New or corrected results invalidate the rolling form of later matches too,
+# and matches removed by a delta drop their rows.
+DELETE_STALE_TEAM_FORM_QUERY = f"""
+    WITH {TEAM_MATCHES_CTE},
+    removed_team_matches AS (
+        SELECT team, match_date FROM sporacle_db.team_form
+        WHERE (team, odd_match_code) NOT IN (SELECT team, odd_match_code FROM team_matches)
+    ),
+    first_stale_match_dates AS (
+        SELECT team, MIN(match_date) as match_date
+        FROM (
+            SELECT team, match_date FROM new_team_matches
+            UNION ALL
+            SELECT team, match_date FROM removed_team_matches
+        )
+        GROUP BY team
+    )
+    DELETE FROM sporacle_db.team_form
+    WHERE team_form.match_date >= (
+        SELECT match_date FROM first_stale_match_dates
+        WHERE first_stale_match_dates.team = team_form.team
+    )
+"""
+
+# Only the last TEAM_FORM_WINDOW - 1 stored matches of the teams with new
+# results are read back to seed the rolling windows of the new rows.
+INSERT_NEW_TEAM_FORM_QUERY = f"""
+    INSERT INTO sporacle_db.team_form
+    WITH {TEAM_MATCHES_CTE},
+    previous_team_matches AS (
+        SELECT team, match_date, odd_match_code, goals_for, goals_against, 0 as is_new
+        FROM (
+            SELECT
+                team_form.*,
+                ROW_NUMBER() OVER (
+                    PARTITION BY team_form.team ORDER BY team_form.match_date DESC
+                ) as match_rank
+            FROM sporacle_db.team_form as team_form
+            WHERE team_form.team IN (SELECT team FROM new_team_matches)
+        )
+        WHERE match_rank < {TEAM_FORM_WINDOW}
+    ),
+    window_team_matches AS (
+        SELECT * FROM previous_team_matches
+        UNION ALL
+        SELECT team, match_date, odd_match_code, goals_for, goals_against, 1 as is_new
+        FROM new_team_matches
+    ),
+    team_form_rows AS (
+        SELECT
+            team, match_date, odd_match_code, goals_for, goals_against,
+            CASE
+                WHEN goals_for > goals_against THEN 3
+                WHEN goals_for = goals_against THEN 1
+                ELSE 0
+            END as points,
+            is_new
+        FROM window_team_matches
+    ),
+    rolling_team_form AS (
+        SELECT
+            team, match_date, odd_match_code, goals_for, goals_against, points,
+            COUNT(*) OVER form_window as form_match_count,
+            SUM(points) OVER form_window as form_points,
+            SUM(goals_for) OVER form_window as form_goals_for,
+            SUM(goals_against) OVER form_window as form_goals_against,
+            {{over_rate_columns}},
+            is_new
+        FROM team_form_rows
+        WINDOW form_window AS (
+            PARTITION BY team ORDER BY match_date, odd_match_code
+            ROWS BETWEEN {TEAM_FORM_WINDOW - 1} PRECEDING AND CURRENT ROW
+        )
+    )
+    SELECT
+        team, match_date, odd_match_code, goals_for, goals_against, points,
+        form_match_count, form_points, form_goals_for, form_goals_against,
+        {{over_rate_column_names}}
+    FROM rolling_team_form
+    WHERE is_new = 1
+    ORDER BY team, match_date
+""".format(
+    over_rate_columns=",\n            ".join(
+        f"AVG(goals_for + goals_against > {threshold}) OVER form_window "
+        f"as form_over_{threshold.replace('.', '_')}_rate"
+        for threshold in TEAM_FORM_OVER_THRESHOLDS
+    ),
+    over_rate_column_names=", ".join(
+        f"form_over_{threshold.replace('.', '_')}_rate"
+        for threshold in TEAM_FORM_OVER_THRESHOLDS
+    )
+)
+
+PROGRAM_TEAM_FORM_COLUMNS = [
+    "form_match_count", "form_points", "form_goals_for", "form_goals_against",
+    *(f"form_over_{threshold.replace('.', '_')}_rate" for threshold in TEAM_FORM_OVER_THRESHOLDS),
+]
+
+# Latest form of both teams of every program match, one primary key seek each
+PROGRAM_TEAM_FORM_QUERY = """
+    SELECT
+        program.odd_match_code as odd_match_code,
+        {team_form_columns}
+    FROM sporacle_db.program as program
+    JOIN sporacle_db.matches as matches USING (odd_match_code)
+    LEFT JOIN sporacle_db.team_form as home_form
+        ON home_form.team = matches.home_team
+        AND home_form.match_date = (
+            SELECT MAX(match_date) FROM sporacle_db.team_form
+            WHERE team = matches.home_team AND match_date < matches.match_date
+        )
+    LEFT JOIN sporacle_db.team_form as away_form
+        ON away_form.team = matches.away_team
+        AND away_form.match_date = (
+            SELECT MAX(match_date) FROM sporacle_db.team_form
+            WHERE team = matches.away_team AND match_date < matches.match_date
+        )
+    WHERE program.match_date > DATE('now')
+""".format(
+    team_form_columns=",\n        ".join(
+        f"{side}_form.{column} as {side}_{column}"
+        for side in ["home", "away"]
+        for column in PROGRAM_TEAM_FORM_COLUMNS
+    )
+)
+
+# Full text index over matches, rebuilt by init_database(). unicode61 with
+# remove_diacritics makes "atletico" find "Atlético".
+CREATE_MATCH_SEARCH_TABLE_QUERY = """
+    CREATE VIRTUAL TABLE sporacle_db.match_search USING fts5(
+        description, home_team, away_team, competition,
+        tokenize = "unicode61 remove_diacritics 2",
+        prefix = '2 3'
+    )
+"""
+
+INSERT_MATCH_SEARCH_QUERY = """
+    INSERT INTO sporacle_db.match_search (rowid, description, home_team, away_team, competition)
+    SELECT
+        matches.odd_match_code,
+        matches.description,
+        matches.home_team,
+        matches.away_team,
+        competitions.name
+    FROM sporacle_db.matches as matches
+    LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
+"""
+
+MATCH_SEARCH_QUERY = """
+    SELECT
+        matches.odd_match_code as odd_match_code,
+        matches.match_date as match_date,
+        competitions.name as competition,
+        matches.description as description,
+        match_search.rank as rank
+    FROM sporacle_db.match_search as match_search
+    JOIN sporacle_db.matches as matches ON matches.odd_match_code = match_search.rowid
+    LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
+    WHERE
+        match_search MATCH :search_query
+        AND matches.match_date > DATE('now')
+    ORDER BY match_search.rank
+    LIMIT :limit
+"""
+
+MATCH_SEARCH_LIMIT = 50
+MATCH_SEARCH_COLUMNS = ["odd_match_code", "match_date", "competition", "description"]
+
+PROGRAM_QUERY = """
+    SELECT
+        program.*
+    FROM sporacle_db.program as program
+    WHERE program.match_date > DATE('now')
+    ORDER BY program.match_date, program.odd_match_code
+"""
+
+ON_GOING_BET_LISTS_QUERY = """
+    SELECT * FROM app_db.bet_lists as bet_lists
+    WHERE bet_lists.last_match_date > DATE('now')
+"""
+
+FUTURE_ODDS_QUERY = """
+    SELECT
+        odds.*
+    FROM sporacle_db.odds as odds 
+    LEFT JOIN sporacle_db.matches as matches USING (odd_match_code)
+    WHERE matches.match_date > DATE('now')
+"""
+
+FUTURE_MATCHES_QUERY = """
+    SELECT
+        matches.odd_match_code as odd_match_code,
+        matches.description as description,
+        matches.match_date as match_date,
+        competitions.name as competition,
+        matches.competition_code as competition_code
+    FROM sporacle_db.matches as matches
+    LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
+    WHERE matches.match_date > DATE('now')
+"""
+
+MATCHES_FOR_ODDS_QUERY = """
+    select
+        matches.odd_match_code,
+        matches.description,
+        matches.match_date as match_datetime,
+        competitions.name as competition
+    from sporacle_db.matches as matches
+    left join sporacle_db.competitions as competitions
+        on matches.competition_code = competitions.competition_code
+    where matches.odd_match_code in {match_codes}
+"""
+
+EXISTING_BET_LIST_SUMMARY_QUERY = """
+    select
+        matches.description,
+        matches.match_date as match_datetime,
+        competitions.name as competition,
+        odds.key as key,
+        odds.odd_name as odd_name,
+        odds.odd_value as odd_value,
+        odds.odd_threshold as odd_threshold,
+        matches.odd_match_code
+    from sporacle_db.odds as odds
+    left join sporacle_db.matches as matches using (odd_match_code)
+    left join sporacle_db.competitions as competitions using (competition_code)
+    where odds.key in {odd_keys}
+"""
+
+ODDS_FOR_MATCHES_QUERY = """
+    SELECT
+        odds.*
+    FROM sporacle_db.odds as odds
+    WHERE odds.odd_match_code IN {match_codes}
+"""
+
+BET_LIST_ODDS_QUERY = """
+    SELECT
+        odds.*
+    FROM app_db.bet_list_odds as bet_list_odds
+    JOIN sporacle_db.odds as odds USING (key)
+    WHERE bet_list_odds.bet_list_name = :bet_list_name
+    ORDER BY bet_list_odds.position
+"""
+
+BET_LISTS_WIDE_QUERY_TEMPLATE = """
+    with extracted_odd_keys as (
+        SELECT
+            bet_lists.bet_list_name, 
+            bet_list_odds.key as key
+        FROM app_db.bet_lists as bet_lists
+        JOIN app_db.bet_list_odds as bet_list_odds USING (bet_list_name)
+        WHERE bet_lists.last_match_date < DATE('now')
+        {bet_lists_filter}
+    ),
+
+    bet_list_summary as (
+        SELECT
+            extracted_odd_keys.bet_list_name as bet_list_name,
+            matches.description as description,
+            matches.match_date as match_date,
+            competitions.name as competition,
+            (
+                matches.half_time_home_goals || '-' || matches.half_time_away_goals
+            ) as half_time_score,
+            (
+                matches.full_time_home_goals || '-' || matches.full_time_away_goals
+            ) as full_time_score,
+            odds.odd_name as odd_name,
+            odds.odd_value as odd_value,
+            odds.is_winning as is_winning,
+            extracted_odd_keys.key as key,
+            odds.odd_match_code as odd_match_code,
+            matches.competition_code as competition_code
+        FROM extracted_odd_keys
+        LEFT JOIN sporacle_db.odds as odds USING (key)
+        LEFT JOIN sporacle_db.matches as matches USING (odd_match_code)
+        LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
+    )
+
+    SELECT
+        bet_list_name,
+        description,
+        match_date,
+        competition,
+        half_time_score,
+        full_time_score,
+        odd_name,
+        odd_value,
+        is_winning
+    FROM bet_list_summary
+"""
+
+BET_LISTS_WIDE_QUERY = BET_LISTS_WIDE_QUERY_TEMPLATE.format(bet_lists_filter="")
+
+# At-term bet lists not settled yet, whose legs all have a result
+UNSETTLED_BET_LISTS_WIDE_QUERY = BET_LISTS_WIDE_QUERY_TEMPLATE.format(
+    bet_lists_filter="""AND bet_lists.bet_list_name NOT IN (
+            SELECT bet_list_name FROM app_db.bet_list_settlements
+        )
+        AND NOT EXISTS (
+            SELECT 1
+            FROM app_db.bet_list_odds as pending_odds
+            LEFT JOIN sporacle_db.odds as odds USING (key)
+            WHERE pending_odds.bet_list_name = bet_lists.bet_list_name
+            AND odds.is_winning IS NULL
+        )"""
+)
+
+ODD_KEYS_VALIDATION_QUERY = """
+    SELECT
+        odds.key as key,
+        odds.odd_match_code as odd_match_code,
+        matches.match_date as match_date
+    FROM sporacle_db.odds as odds
+    JOIN sporacle_db.matches as matches USING (odd_match_code)
+    WHERE odds.key IN {odd_keys}
+"""
+
+BET_LISTS_EXPORT_QUERY = """
+    SELECT
+        bet_lists.bet_list_name as bet_list_name,
+        bet_list_odds.position as position,
+        bet_list_odds.key as key,
+        bet_list_odds.odd_match_code as odd_match_code,
+        bet_lists.creation_date as creation_date
+    FROM app_db.bet_lists as bet_lists
+    JOIN app_db.bet_list_odds as bet_list_odds USING (bet_list_name)
+    ORDER BY bet_lists.bet_list_name, bet_list_odds.position
+"""
+
+DELETE_BET_LIST_ODDS_QUERY = """
+    DELETE FROM app_db.bet_list_odds WHERE bet_list_name IN {bet_list_names}
+"""
+
+DELETE_BET_LIST_SETTLEMENTS_QUERY = """
+    DELETE FROM app_db.bet_list_settlements WHERE bet_list_name IN {bet_list_names}
+"""
+
+BACKTEST_ODDS_QUERY = """
+    SELECT
+        odds.key as key,
+        odds.odd_name as odd_name,
+        odds.odd_value as odd_value,
+        odds.is_winning as is_winning,
+        odds.odd_match_code as odd_match_code,
+        matches.match_date as match_date,
+        matches.competition_code as competition_code
+    FROM sporacle_db.odds as odds
+    JOIN sporacle_db.matches as matches USING (odd_match_code)
+    WHERE
+        odds.is_winning IS NOT NULL
+        AND odds.odd_value BETWEEN :min_odd_value AND :max_odd_value
+        AND matches.match_date < DATE('now')
+"""
+
+SETTLED_BET_LISTS_QUERY = """
+    SELECT
+        bet_list_name,
+        odds_product,
+        match_count,
+        losing_match_count,
+        is_winning
+    FROM app_db.bet_list_settlements
+    WHERE is_winning = :is_winning
+    ORDER BY settlement_date DESC, bet_list_name
+    LIMIT :limit OFFSET :offset
+"""
+
+SETTLED_BET_LISTS_COUNT_QUERY = """
+    SELECT
+        COALESCE(SUM(is_winning), 0) as winning,
+        COUNT(*) - COALESCE(SUM(is_winning), 0) as losing
+    FROM app_db.bet_list_settlements
+"""
+
+# Leg details of a few bet lists, read through the bet_list_odds primary key
+BET_LIST_LEGS_QUERY = """
+    SELECT
+        bet_list_odds.bet_list_name as bet_list_name,
+        matches.description as description,
+        matches.match_date as match_date,
+        competitions.name as competition,
+        (
+            matches.half_time_home_goals || '-' || matches.half_time_away_goals
+        ) as half_time_score,
+        (
+            matches.full_time_home_goals || '-' || matches.full_time_away_goals
+        ) as full_time_score,
+        odds.odd_name as odd_name,
+        odds.odd_value as odd_value,
+        odds.is_winning as is_winning
+    FROM app_db.bet_list_odds as bet_list_odds
+    LEFT JOIN sporacle_db.odds as odds ON odds.key = bet_list_odds.key
+    LEFT JOIN sporacle_db.matches as matches ON matches.odd_match_code = odds.odd_match_code
+    LEFT JOIN sporacle_db.competitions as competitions
+        ON competitions.competition_code = matches.competition_code
+    WHERE bet_list_odds.bet_list_name IN {bet_list_names}
+    ORDER BY bet_list_odds.bet_list_name, bet_list_odds.position
+"""
+
+# Settled bet lists shown per page of the at-term page
+SETTLED_BET_LISTS_PAGE_SIZE = 20
+# Key sets above this size are sent as one JSON array parameter, so the SQL
+# text (and its prepared statement) no longer depends on the number of keys.
+KEY_SET_JSON_THRESHOLD = 64
+KEY_SET_JSON_SQL = "(SELECT value FROM json_each(:{param_name}))"
+
+# Rows fetched from the cursor per Arrow record batch
+FETCH_ARRAYSIZE = 10_000
+
+ODDS_DTYPES = {
+    "odd_match_code": "id",
+    "odd_name": "category",
+    "odd_value": "float",
+    "odd_threshold": "float",
+}
+
+PROGRAM_DTYPES = {odd_name: "float" for odd_name in PROGRAM_ODDS_COLUMNS}
+
+HOT_QUERIES = {
+    "program": (PROGRAM_QUERY, {}),
+    "on_going_bet_lists": (ON_GOING_BET_LISTS_QUERY, {}),
+    "future_odds": (FUTURE_ODDS_QUERY, {}),
+    "future_matches": (FUTURE_MATCHES_QUERY, {}),
+    "matches_for_odds": (
+        MATCHES_FOR_ODDS_QUERY.format(
+            match_codes=KEY_SET_JSON_SQL.format(param_name="match_codes")
+        ),
+        {"match_codes": "[]"}
+    ),
+    "existing_bet_list_summary": (
+        EXISTING_BET_LIST_SUMMARY_QUERY.format(
+            odd_keys=KEY_SET_JSON_SQL.format(param_name="odd_keys")
+        ),
+        {"odd_keys": "[]"}
+    ),
+    "odds_for_matches": (
+        ODDS_FOR_MATCHES_QUERY.format(
+            match_codes=KEY_SET_JSON_SQL.format(param_name="match_codes")
+        ),
+        {"match_codes": "[]"}
+    ),
+    "program_team_form": (PROGRAM_TEAM_FORM_QUERY, {}),
+    **(
+        {
+            "match_search": (
+                MATCH_SEARCH_QUERY,
+                {"search_query": '"a"*', "limit": MATCH_SEARCH_LIMIT}
+            )
+        }
+        if is_fts5_available() else {}
+    ),
+    "bet_list_odds": (BET_LIST_ODDS_QUERY, {"bet_list_name": ""}),
+    "odd_keys_validation": (
+        ODD_KEYS_VALIDATION_QUERY.format(
+            odd_keys=KEY_SET_JSON_SQL.format(param_name="odd_keys")
+        ),
+        {"odd_keys": "[]"}
+    ),
+    "bet_lists_export": (BET_LISTS_EXPORT_QUERY, {}),
+    "bet_lists_wide": (BET_LISTS_WIDE_QUERY, {}),
+    "unsettled_bet_lists_wide": (UNSETTLED_BET_LISTS_WIDE_QUERY, {}),
+    "settled_bet_lists": (
+        SETTLED_BET_LISTS_QUERY, {"is_winning": True, "limit": 1, "offset": 0}
+    ),
+    "bet_list_legs": (
+        BET_LIST_LEGS_QUERY.format(
+            bet_list_names=KEY_SET_JSON_SQL.format(param_name="bet_list_names")
+        ),
+        {"bet_list_names": "[]"}
+    ),
+}
 
+# Local bet lists and json_each() are scanned by design, they are small.
+# Virtual tables queried through their own index (FTS5 MATCH) are not scans.
+PLAN_ALLOWED_FULL_SCANS = {
+    "bet_lists", "bet_list_settlements", "json_each", "CONSTANT"
+}
 #endregion
 
 #region Query utils
-def get_table_from_query(engine, query):
+def bind_key_set(query, param_name, keys):
+    ls_keys = pd.Series(keys).tolist()
+    if len(ls_keys) > KEY_SET_JSON_THRESHOLD:
+        statement = sqlalchemy.text(
+            query.format(**{param_name: KEY_SET_JSON_SQL.format(param_name=param_name)})
+        )
+        return statement, {param_name: json.dumps(ls_keys)}
+    statement = (
+        sqlalchemy.text(query.format(**{param_name: f":{param_name}"}))
+        .bindparams(bindparam(param_name, expanding=True))
+    )
+    return statement, {param_name: ls_keys}
+
+def cast_arrow_array(array, dtype_hint=None):
+    if dtype_hint == "id":
+        return array.cast(pa.int64())
+    if dtype_hint == "float":
+        return array.cast(pa.float64())
+    if dtype_hint == "category":
+        return array.cast(pa.string()).dictionary_encode()
+    if dtype_hint == "datetime":
+        if not pa.types.is_timestamp(array.type):
+            array = array.cast(pa.string()).cast(pa.timestamp("us"))
+        return array.cast(pa.timestamp("us", tz="UTC"))
+    return array
+
+def to_arrow_array(values, dtype_hint=None):
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # SQLite columns can mix storage classes, keep their text form
+        array = pa.array([None if v is None else str(v) for v in values])
+    return cast_arrow_array(array, dtype_hint)
+
+def get_common_arrow_type(arrow_type, other_arrow_type):
+    return pa.unify_schemas(
+        [pa.schema([("column", arrow_type)]), pa.schema([("column", other_arrow_type)])],
+        promote_options="permissive"
+    ).field("column").type
+
+def append_column_values(column, values):
+    # A column is {"chunks": [pa.Array], "values": None} while every fetched
+    # batch fits one Arrow type (int64 and float64 batches give float64, all
+    # NULL batches take any type). SQLite columns can mix storage classes: once
+    # a batch does not fit, the whole column falls back to its Python values.
+    if column["values"] is not None:
+        column["values"].extend(values)
+        return
+    try:
+        chunk = pa.array(values)
+        if column["chunks"] and chunk.type != column["chunks"][0].type:
+            common_type = get_common_arrow_type(column["chunks"][0].type, chunk.type)
+            column["chunks"] = [
+                column_chunk.cast(common_type) for column_chunk in column["chunks"]
+            ]
+            chunk = chunk.cast(common_type)
+        column["chunks"].append(chunk)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        column["values"] = [
+            value for column_chunk in column["chunks"] for value in column_chunk.to_pylist()
+        ] + values
+        column["chunks"] = []
+
+def get_column_array(column, dtype_hint=None):
+    # Python values are only kept for an unhinted column of mixed types
+    if column["values"] is None:
+        return cast_arrow_array(pa.chunked_array(column["chunks"]), dtype_hint)
+    if dtype_hint is None:
+        return pd.Series(column["values"], dtype=object)
+    return to_arrow_array(column["values"], dtype_hint)
+
+def execute_query(connection, query, params=None):
+    if isinstance(query, str):
+        query = sqlalchemy.text(query)
+    return connection.execute(query, params or {})
+
+def get_table_from_query(engine, query, params=None, dtypes=None):
+    start = time.perf_counter()
     with engine.connect() as connection:
-        query = connection.execute(
-            sqlalchemy.text(query)
+        result = execute_query(connection, query, params)
+        cols = list(result.keys())
+        ls_columns = [{"chunks": [], "values": None} for _ in cols]
+        row_count = 0
+        while rows := result.fetchmany(FETCH_ARRAYSIZE):
+            row_count += len(rows)
+            for column, values in zip(ls_columns, zip(*rows)):
+                append_column_values(column, list(values))
+        # Final SQL and parameters, after expanding IN parameters
+        sql, sql_params = result.context.statement, result.context.parameters
+    fetch_end = time.perf_counter()
+    dtypes = dtypes or {}
+    if not row_count:
+        df = pd.DataFrame(columns=cols)
+    else:
+        ls_arrays = [
+            get_column_array(column, dtypes.get(col))
+            for col, column in zip(cols, ls_columns)
+        ]
+        ls_object_positions = [
+            position for position, array in enumerate(ls_arrays)
+            if isinstance(array, pd.Series)
+        ]
+        df = (
+            pa.Table.from_arrays(
+                [
+                    pa.nulls(row_count) if position in ls_object_positions else array
+                    for position, array in enumerate(ls_arrays)
+                ],
+                names=cols
+            )
+            .to_pandas(integer_object_nulls=True)
         )
-        cols = query.keys()
-        df = pd.DataFrame.from_records(
-            data=query.fetchall(),
-            columns=cols
+        for position in ls_object_positions:
+            df.isetitem(position, ls_arrays[position])
+    if _profiling_enabled:
+        end = time.perf_counter()
+        record_timing(
+            "sql",
+            " ".join(sql.split())[:60],
+            end - start,
+            sql=sql,
+            params=sql_params[0] if sql_params else None,
+            row_count=len(df),
+            build_time=end - fetch_end
         )
     return df
 
-def get_table(table_name):
-    engine = get_sqlalchemy_sporacle_engine()
+def explain_query(sql, params=None):
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
     with engine.connect() as connection:
-        query = connection.execute(
-            sqlalchemy.text(f'select * from {table_name}')
-        )
-        cols = query.keys()
-        df = pd.DataFrame.from_records(
-            data=query.fetchall(),
-            columns=cols
-        )
-    return df
+        plan = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {sql}",
+            params or ()
+        ).all()
+    return [row.detail for row in plan]
+
+def get_table(table_name, dtypes=None):
+    engine = get_sqlalchemy_sporacle_engine()
+    return get_table_from_query(
+        engine=engine,
+        query=f'select * from {table_name}',
+        dtypes=dtypes
+    )
 
-def get_localdb_table(table_name):
+def get_localdb_table(table_name, dtypes=None):
     engine = get_sqlalchemy_local_db_engine()
-    with engine.connect() as connection:
-        query = connection.execute(
-            sqlalchemy.text(f'select * from {table_name}')
-        )
-        cols = query.keys()
-        df = pd.DataFrame.from_records(
-            data=query.fetchall(),
-            columns=cols
-        )
-    return df
+    return get_table_from_query(
+        engine=engine,
+        query=f'select * from {table_name}',
+        dtypes=dtypes
+    )
 
 def get_matches_table():
     return get_table("matches")
 
+@profiled
 def get_odds_table():
-    return get_table("odds")
+    return get_table("odds", dtypes=ODDS_DTYPES)
 
 def get_competitions():
     return get_table('competitions')
 
+@profiled
+@cached_result
 def get_on_going_bet_lists():
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    query = """
-    SELECT * FROM app_db.bet_lists as bet_lists
-    WHERE bet_lists.last_match_date > DATE('now')
-    """
+    query = ON_GOING_BET_LISTS_QUERY
     df_on_going_bet_lists = get_table_from_query(
         engine=engine, 
         query=query
     )
     return df_on_going_bet_lists
 
+@profiled
+@cached_result
 def get_future_odds():
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    query = """
-    SELECT
-        odds.*
-    FROM sporacle_db.odds as odds 
-    LEFT JOIN sporacle_db.matches as matches USING (odd_match_code)
-    WHERE matches.match_date > DATE('now')
-    """
+    query = FUTURE_ODDS_QUERY
     df_future_odds = get_table_from_query(
         engine=engine, 
         query=query
     )
     return df_future_odds
 
+@profiled
+@cached_result
 def get_future_matches():
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    query = """
-    SELECT
-        matches.odd_match_code as odd_match_code,
-        matches.description as description,
-        matches.match_date as match_date,
-        competitions.name as competition,
-        matches.competition_code as competition_code
-    FROM sporacle_db.matches as matches
-    LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
-    WHERE matches.match_date > DATE('now')
-    """
+    query = FUTURE_MATCHES_QUERY
     df_future_matches = get_table_from_query(
         engine=engine, 
         query=query
@@ -270,44 +1653,137 @@ def get_future_matches():
     )
 
 
-def get_program():
+@profiled
+@cached_result
+def get_program(with_margins=False):
     final_cols = [
-        'match_date', 'competition', 'description', 
-        '1', 'X', '2', 
-        '1X', 'X2', '12', 
-        '- 0.5 go.', '+ 0.5 go.', 
-        '- 1.5 go.', '+ 1.5 go.',
-        '- 2.5 go.', '+ 2.5 go.',
-        '- 3.5 go.', '+ 3.5 go.', 
-        '- 4.5 go.', '+ 4.5 go.',
-        '- 5.5 go.', '+ 5.5 go.',
+        'match_date', 'competition', 'description',
+        *PROGRAM_ODDS_COLUMNS,
         'odd_match_code'
     ]
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    query = """
-    SELECT
-        matches.odd_match_code as odd_match_code,
-        matches.description as description,
-        matches.match_date as match_date,
-        competitions.name as competition,
-        matches.competition_code as competition_code
-    FROM sporacle_db.matches as matches
-    LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
-    WHERE matches.match_date > DATE('now')
-    """
-    df_future_matches = get_future_matches()
-    df_raw_future_odds = get_future_odds()
-    df_future_odds = clean_odds(df_raw_future_odds)
-    return (
-        df_future_odds.merge(
-            df_future_matches,
-            on="odd_match_code",
-            how="right",
-            validate="1:m"
-        )
+    df_program = get_table_from_query(
+        engine=engine,
+        query=PROGRAM_QUERY,
+        dtypes=PROGRAM_DTYPES
+    )
+    df_program = (
+        df_program
+        .astype({"match_date":"datetime64[ns, UTC]"})
         [final_cols]
     )
+    if with_margins:
+        df_margins = get_market_margins(df_program[PROGRAM_ODDS_COLUMNS].to_numpy())
+        df_program = pd.concat([df_program, df_margins.set_axis(df_program.index)], axis=1)
+    return df_program
+
+
+@profiled
+@cached_result
+def get_program_team_form():
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    return get_table_from_query(
+        engine=engine,
+        query=PROGRAM_TEAM_FORM_QUERY,
+        dtypes={
+            "odd_match_code": "id",
+            **{
+                f"{side}_{column}": "float"
+                for side in ["home", "away"]
+                for column in PROGRAM_TEAM_FORM_COLUMNS
+            }
+        }
+    )
+
+
+@profiled
+def get_odds_by_match(match_codes):
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    query, params = bind_key_set(ODDS_FOR_MATCHES_QUERY, "match_codes", match_codes)
+    df_odds = get_table_from_query(
+        engine=engine,
+        query=query,
+        params=params
+    )
+    dc_pivot = pivot_odds(df_odds, match_codes)
+    dc_raw_odds = dict(tuple(df_odds.groupby("odd_match_code")))
+    return {
+        match_code: (
+            dc_raw_odds.get(match_code, df_odds.iloc[0:0]),
+            get_match_odds_view(dc_pivot, row)
+        )
+        for row, match_code in enumerate(dc_pivot["match_codes"])
+    }
+
+
+@profiled
+@cached_result
+def get_match_odds_cards(match_codes):
+    # One precomputed card per match: its wide odds in market order, the
+    # markets it offers and its raw odds by name, so a selection is a dict
+    # lookup instead of a query. match_codes is a tuple to be usable as a cache key.
+    dc_match_odds = get_odds_by_match(list(match_codes))
+    return {
+        match_code: {
+            "df_odds": df_match_odds,
+            "odd_names": df_match_odds.columns[df_match_odds.notna().any()].to_list(),
+            "dc_odds": {
+                odd["odd_name"]: odd
+                for odd in df_raw_match_odds.to_dict(orient="records")
+            },
+        }
+        for match_code, (df_raw_match_odds, df_match_odds) in dc_match_odds.items()
+    }
+
+
+def remove_diacritics(text):
+    return "".join(
+        character for character in unicodedata.normalize("NFKD", text)
+        if not unicodedata.combining(character)
+    )
+
+def get_match_search_tokens(search_text):
+    return re.findall(r"\w+", remove_diacritics(search_text).lower())
+
+@profiled
+def search_matches(search_text, limit=MATCH_SEARCH_LIMIT):
+    # Every word of search_text must prefix a word of the match description,
+    # its teams or its competition. Best FTS5 (bm25) matches come first.
+    ls_tokens = get_match_search_tokens(search_text)
+    if not ls_tokens:
+        return pd.DataFrame(columns=MATCH_SEARCH_COLUMNS)
+    if not is_fts5_available():
+        return search_future_matches(ls_tokens, limit)
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    df_matches = get_table_from_query(
+        engine=engine,
+        query=MATCH_SEARCH_QUERY,
+        params={
+            "search_query": " ".join(f'"{token}"*' for token in ls_tokens),
+            "limit": limit,
+        },
+        dtypes={"odd_match_code": "id", "rank": "float"}
+    )
+    return df_matches.astype({"match_date": "datetime64[ns, UTC]"})
 
+def search_future_matches(ls_tokens, limit):
+    # Fallback for SQLite builds without FTS5
+    df_future_matches = get_future_matches()
+    s_words = (
+        (df_future_matches["description"] + " " + df_future_matches["competition"].fillna(""))
+        .map(lambda text: get_match_search_tokens(text))
+    )
+    s_is_match = s_words.map(
+        lambda ls_words: all(
+            any(word.startswith(token) for word in ls_words) for token in ls_tokens
+        )
+    )
+    return (
+        df_future_matches[s_is_match]
+        .sort_values("match_date")
+        .head(limit)
+        [MATCH_SEARCH_COLUMNS]
+    )
 
 def get_bet_list_names_in_db():
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
@@ -316,51 +1792,31 @@ def get_bet_list_names_in_db():
         results = session.execute(select_statement).all()
     return [r[0] for r in results]
     
+@profiled
 def get_matches_for_odds(match_codes):
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    match_codes_as_str = ', '.join(
-        [f"'{code}'" for code in match_codes]
-    )
-    query = """
-    select
-        matches.odd_match_code,
-        matches.description,
-        matches.match_date as match_datetime,
-        competitions.name as competition
-    from sporacle_db.matches as matches
-    left join sporacle_db.competitions as competitions
-        on matches.competition_code = competitions.competition_code
-    where matches.odd_match_code in ({match_codes})
-    """.format(
-        match_codes=match_codes_as_str
-    )
+    query, params = bind_key_set(MATCHES_FOR_ODDS_QUERY, "match_codes", match_codes)
     df_matches = get_table_from_query(
         engine=engine, 
-        query=query
+        query=query,
+        params=params
     )
     return df_matches
 
 
+@profiled
 def get_odds_for_bet_list(bet_list_name):
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    with Session(engine) as session:
-        bet_list_statement = (
-            select(BetList)
-            .where(BetList.bet_list_name==bet_list_name)
-        )
-        bet_list = session.scalars(bet_list_statement).one()
-        ls_odd_keys = [o for o in bet_list.odds]
-        odds_statement = (
-            select(Odd)
-            .where(Odd.key.in_(ls_odd_keys))
-        )
-        odds = session.scalars(odds_statement).all()
-        ls_odds = [odd.__dict__ for odd in odds]
-    df = pd.DataFrame(ls_odds)
+    df = get_table_from_query(
+        engine=engine,
+        query=BET_LIST_ODDS_QUERY,
+        params={"bet_list_name": bet_list_name}
+    )
     return df
 
 
-def get_bet_list_df(bet_list_name):
+@profiled
+def get_bet_list_df(bet_list_name, with_margins=False):
     final_cols = [
         'match_datetime', 'competition', 'description', 
         'odd_name', 'odd_value',
@@ -369,7 +1825,7 @@ def get_bet_list_df(bet_list_name):
     ]
     df_odds = get_odds_for_bet_list(bet_list_name)
     df_matches = get_matches_for_odds(df_odds.odd_match_code.to_list())
-    return (
+    df_bet_list = (
         df_odds.merge(
             df_matches,
             on="odd_match_code",
@@ -381,39 +1837,192 @@ def get_bet_list_df(bet_list_name):
         )
         [final_cols]
     )
+    if with_margins:
+        df_bet_list = pd.concat(
+            [df_bet_list, get_bet_list_odd_margins(df_bet_list)],
+            axis=1
+        )
+    return df_bet_list
 
 def get_selected_matches_for_bet_list(bet_list_name):
     df_odds = get_odds_for_bet_list(bet_list_name)
     return df_odds.odd_match_code.to_list()
 
-def get_existing_bet_list_summary(odd_keys):    
-    odd_keys_as_str = ', '.join(
-        [f"'{key}'" for key in odd_keys]
-    )
+@profiled
+def get_existing_bet_list_summary(odd_keys):
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    query = """
-    select
-        matches.description,
-        matches.match_date as match_datetime,
-        competitions.name as competition,
-        odds.key as key,
-        odds.odd_name as odd_name,
-        odds.odd_value as odd_value,
-        odds.odd_threshold as odd_threshold,
-        matches.odd_match_code
-    from sporacle_db.odds as odds
-    left join sporacle_db.matches as matches using (odd_match_code)
-    left join sporacle_db.competitions as competitions using (competition_code)
-    where odds.key in ({odd_keys})
-    """.format(odd_keys=odd_keys_as_str)
+    query, params = bind_key_set(EXISTING_BET_LIST_SUMMARY_QUERY, "odd_keys", odd_keys)
     df_summary = get_table_from_query(
         engine=engine, 
-        query=query
+        query=query,
+        params=params
     )
     return df_summary.to_dict(orient="records")
+
+def get_full_table_scans(engine, query, params=None):
+    with engine.connect() as connection:
+        plan = connection.execute(
+            sqlalchemy.text(f"EXPLAIN QUERY PLAN {query}"),
+            params or {}
+        ).all()
+    return [
+        row.detail for row in plan
+        if row.detail.startswith("SCAN ")
+        and row.detail.split()[1] not in PLAN_ALLOWED_FULL_SCANS
+        and "VIRTUAL TABLE INDEX" not in row.detail
+    ]
+
+def check_query_plans(engine=IN_MEMORY_SQLALCHEMY_DB_ENGINE):
+    dc_full_scans = {
+        query_name: get_full_table_scans(engine, query, params)
+        for query_name, (query, params) in HOT_QUERIES.items()
+    }
+    return {
+        query_name: full_scans
+        for query_name, full_scans in dc_full_scans.items()
+        if full_scans
+    }
+#endregion
+
+#region Query console
+QUERY_CONSOLE_DATABASES = ["Sporacle", "Local DB", "Cross-Database"]
+QUERY_CONSOLE_ROW_CAP = 100_000
+QUERY_CONSOLE_PAGE_SIZE = 100
+QUERY_CONSOLE_TIME_BUDGET = 5.0
+QUERY_CONSOLE_EXPORT_TIME_BUDGET = 60.0
+# SQLite VM instructions between two time budget checks
+QUERY_PROGRESS_OPCODES = 10_000
+
+def get_read_only_connection(db_name):
+    local_db_uri = f"file:{LOCAL_DB_PATH}?mode=ro"
+    if db_name == "Sporacle":
+        con = sqlite3.connect(SPORACLE_DB_URI, uri=True)
+    elif db_name == "Local DB":
+        con = sqlite3.connect(local_db_uri, uri=True)
+    elif db_name == "Cross-Database":
+        con = sqlite3.connect("file::memory:", uri=True)
+        con.execute(f"attach '{SPORACLE_DB_URI}' as sporacle_db;")
+        con.execute(f"attach '{local_db_uri}' as app_db;")
+    else:
+        raise NotImplementedError(
+            f"The database should be one of {', '.join(QUERY_CONSOLE_DATABASES)}"
+        )
+    con.execute("PRAGMA query_only = 1;")
+    return con
+
+def iter_guarded_rows(db_name, query, row_cap, time_budget, arraysize=QUERY_CONSOLE_PAGE_SIZE):
+    # The progress handler aborts the statement once the time budget is spent,
+    # so a runaway query cannot freeze the (single) Pyodide thread.
+    # Yields (column names, raw row tuples) per fetched chunk.
+    con = get_read_only_connection(db_name)
+    deadline = time.perf_counter() + time_budget
+    con.set_progress_handler(
+        lambda: int(time.perf_counter() > deadline),
+        QUERY_PROGRESS_OPCODES
+    )
+    try:
+        cursor = con.execute(query)
+        cols = [col[0] for col in cursor.description or []]
+        row_count = 0
+        while row_count < row_cap:
+            rows = cursor.fetchmany(min(arraysize, row_cap - row_count))
+            if not rows:
+                break
+            row_count += len(rows)
+            yield cols, rows
+    finally:
+        con.close()
+
+def iter_guarded_query(db_name, query, row_cap, time_budget, arraysize=QUERY_CONSOLE_PAGE_SIZE):
+    for cols, rows in iter_guarded_rows(db_name, query, row_cap, time_budget, arraysize):
+        yield pd.DataFrame.from_records(rows, columns=cols)
+
+def run_guarded_query(
+    db_name,
+    query,
+    page=0,
+    page_size=QUERY_CONSOLE_PAGE_SIZE,
+    row_cap=QUERY_CONSOLE_ROW_CAP,
+    time_budget=QUERY_CONSOLE_TIME_BUDGET
+):
+    # Streams through the result to count rows, keeping only the raw rows of one
+    # page. One row past row_cap is fetched to tell a capped result from one of
+    # exactly row_cap rows.
+    start = time.perf_counter()
+    cols, ls_page_rows = [], []
+    row_count = 0
+    is_interrupted = False
+    try:
+        for page_index, (cols, rows) in enumerate(
+            iter_guarded_rows(db_name, query, row_cap + 1, time_budget, page_size)
+        ):
+            if page_index == page:
+                ls_page_rows = rows[:max(0, row_cap - page * page_size)]
+            row_count += len(rows)
+    except sqlite3.OperationalError as e:
+        if "interrupted" not in str(e):
+            raise
+        is_interrupted = True
+    return {
+        "df_page": pd.DataFrame.from_records(ls_page_rows, columns=cols),
+        "row_count": min(row_count, row_cap),
+        "is_capped": row_count > row_cap,
+        "is_interrupted": is_interrupted,
+        "elapsed": time.perf_counter() - start,
+    }
+
+def export_guarded_query(db_name, query, file_path, time_budget=QUERY_CONSOLE_EXPORT_TIME_BUDGET):
+    # An export stopped by its time budget is incomplete, its file is removed
+    row_count = 0
+    is_interrupted = False
+    try:
+        with open(file_path, 'w', newline='') as f:
+            for df_chunk in iter_guarded_query(
+                db_name, query, sys.maxsize, time_budget, FETCH_ARRAYSIZE
+            ):
+                df_chunk.to_csv(f, header=(row_count == 0), index=False)
+                row_count += len(df_chunk)
+    except sqlite3.OperationalError as e:
+        if "interrupted" not in str(e):
+            raise
+        is_interrupted = True
+        pathlib.Path(file_path).unlink(missing_ok=True)
+    return {"row_count": row_count, "is_interrupted": is_interrupted}
+
 #endregion
 
 #region Data Cleaning
+# Wide odds always use the PROGRAM_ODDS_COLUMNS vocabulary: odd names are
+# encoded against it and odd values scattered into one (matches x markets)
+# float64 matrix, instead of a hash based DataFrame.pivot per consumer.
+def pivot_odds(df_odds, match_codes=None):
+    s_odd_names = df_odds["odd_name"]
+    if isinstance(s_odd_names.dtype, pd.CategoricalDtype):
+        # Only the category labels are recoded, not every row
+        ar_odd_name_codes = s_odd_names.cat.set_categories(PROGRAM_ODDS_COLUMNS).cat.codes.to_numpy()
+    else:
+        ar_codes, ar_odd_names = pd.factorize(s_odd_names)
+        ar_odd_name_codes = pd.Index(PROGRAM_ODDS_COLUMNS).get_indexer(ar_odd_names)[ar_codes]
+    if match_codes is None:
+        ar_rows, ar_match_codes = pd.factorize(df_odds["odd_match_code"], sort=True)
+    else:
+        ar_match_codes = np.asarray(match_codes)
+        ar_rows = pd.Index(ar_match_codes).get_indexer(df_odds["odd_match_code"])
+    ar_odds = np.full((len(ar_match_codes), len(PROGRAM_ODDS_COLUMNS)), np.nan)
+    ar_is_known = (ar_odd_name_codes >= 0) & (ar_rows >= 0)
+    ar_odds[ar_rows[ar_is_known], ar_odd_name_codes[ar_is_known]] = (
+        df_odds["odd_value"].to_numpy(dtype=np.float64)[ar_is_known]
+    )
+    return {"match_codes": np.asarray(ar_match_codes), "odds": ar_odds}
+
+def get_match_odds_view(dc_pivot, row):
+    # One row DataFrame sharing the pivot matrix memory
+    return pd.DataFrame(
+        dc_pivot["odds"][row:row + 1],
+        columns=PROGRAM_ODDS_COLUMNS,
+        copy=False
+    )
+
 def clean_odds(df):
     ordered_columns_ls = [
         'odd_match_code',
@@ -424,24 +2033,103 @@ def clean_odds(df):
         '- 2.5 go.', '+ 2.5 go.', '- 3.5 go.', '+ 3.5 go.',
         '- 4.5 go.', '+ 4.5 go.', '- 5.5 go.', '+ 5.5 go.'
     ]
+    dc_pivot = pivot_odds(df)
     return (
-        df
-        .pivot(
-            values="odd_value",
-            columns="odd_name",
-            index="odd_match_code"
-        )
-        .reset_index(drop=False)
-        .rename_axis(None, axis=1)
+        pd.DataFrame(dc_pivot["odds"], columns=PROGRAM_ODDS_COLUMNS, copy=False)
+        .assign(odd_match_code=dc_pivot["match_codes"])
         .reindex(ordered_columns_ls,axis=1)
     )
 #endregion
 
+#region Market margins
+def get_market_group_matrix():
+    # (odds columns x market groups) membership matrix
+    ar_group_matrix = np.zeros((len(PROGRAM_ODDS_COLUMNS), len(PROGRAM_MARKET_GROUPS)))
+    for group_position, (odd_names, _) in enumerate(PROGRAM_MARKET_GROUPS.values()):
+        for odd_name in odd_names:
+            ar_group_matrix[PROGRAM_ODDS_COLUMNS.index(odd_name), group_position] = 1.0
+    return ar_group_matrix
+
+def get_market_margins(ar_odds):
+    # ar_odds is a (matches x PROGRAM_ODDS_COLUMNS) array of decimal odds.
+    # A market group with a missing odd gets NaN margins and fair odds.
+    ar_group_matrix = get_market_group_matrix()
+    ar_odd_groups = ar_group_matrix.argmax(axis=1)
+    ar_group_totals = np.array([total for _, total in PROGRAM_MARKET_GROUPS.values()])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ar_implied_probabilities = 1.0 / ar_odds.astype(np.float64)
+        ar_is_missing = np.isnan(ar_implied_probabilities)
+        ar_book_ratios = np.where(
+            (ar_is_missing @ ar_group_matrix) > 0,
+            np.nan,
+            (np.nan_to_num(ar_implied_probabilities) @ ar_group_matrix) / ar_group_totals
+        )
+        ar_fair_odds = ar_book_ratios[:, ar_odd_groups] / ar_implied_probabilities
+    return pd.concat(
+        [
+            pd.DataFrame(
+                ar_implied_probabilities,
+                columns=[f"P({odd_name})" for odd_name in PROGRAM_ODDS_COLUMNS]
+            ),
+            pd.DataFrame(
+                ar_fair_odds,
+                columns=[f"Fair {odd_name}" for odd_name in PROGRAM_ODDS_COLUMNS]
+            ),
+            pd.DataFrame(
+                ar_book_ratios - 1.0,
+                columns=[f"Margin {group_name}" for group_name in PROGRAM_MARKET_GROUPS]
+            ),
+        ],
+        axis=1
+    )
+
+def get_bet_list_odd_margins(df_bet_list):
+    # Margins of the market each bet list odd belongs to, one row per odd
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    ls_match_codes = df_bet_list["odd_match_code"].to_list()
+    query, params = bind_key_set(ODDS_FOR_MATCHES_QUERY, "match_codes", ls_match_codes)
+    df_odds = get_table_from_query(engine=engine, query=query, params=params)
+    dc_pivot = pivot_odds(df_odds, pd.unique(pd.Series(ls_match_codes)))
+    ar_odds = dc_pivot["odds"][
+        pd.Index(dc_pivot["match_codes"]).get_indexer(ls_match_codes)
+    ]
+    df_margins = get_market_margins(ar_odds)
+    ar_odd_positions = (
+        df_bet_list["odd_name"]
+        .map({odd_name: position for position, odd_name in enumerate(PROGRAM_ODDS_COLUMNS)})
+        .to_numpy()
+    )
+    ar_is_known = ~np.isnan(ar_odd_positions)
+    ar_odd_positions = np.nan_to_num(ar_odd_positions).astype(int)
+    ar_odd_groups = get_market_group_matrix().argmax(axis=1)[ar_odd_positions]
+    ar_rows = np.arange(len(ls_match_codes))
+    n_odds = len(PROGRAM_ODDS_COLUMNS)
+    ar_margins = df_margins.to_numpy()
+    return pd.DataFrame(
+        {
+            "implied_probability": ar_margins[ar_rows, ar_odd_positions],
+            "fair_odd_value": ar_margins[ar_rows, n_odds + ar_odd_positions],
+            "market_margin": ar_margins[ar_rows, 2 * n_odds + ar_odd_groups],
+        },
+        index=df_bet_list.index
+    ).where(pd.Series(ar_is_known, index=df_bet_list.index), axis=0)
+
+#endregion
+
 #region CUD        
+@profiled
 def upsert_bet_list(bet_list_name, bet_list_odds):
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
     odd_keys = [odd_dict["key"] for odd_dict in bet_list_odds]
     odd_dates = [odd_dict["match_datetime"] for odd_dict in bet_list_odds]
+    odd_entries = [
+        BetListOdd(
+            position=position,
+            key=odd_dict["key"],
+            odd_match_code=odd_dict.get("odd_match_code")
+        )
+        for position, odd_dict in enumerate(bet_list_odds)
+    ]
     with Session(engine) as session: 
         with session.begin():
             # Fetch existing bet list object if exists
@@ -456,6 +2144,8 @@ def upsert_bet_list(bet_list_name, bet_list_odds):
             if bet_list_exists:
                 existing_bet_list = session.scalar(existing_bet_list_statement)
                 existing_bet_list.odds = odd_keys
+                existing_bet_list.odd_entries = odd_entries
+                existing_bet_list.settlement = None
                 existing_bet_list.earliest_match_date = min(odd_dates)
                 existing_bet_list.last_match_date = max(odd_dates)
                 session.add(existing_bet_list)
@@ -463,11 +2153,14 @@ def upsert_bet_list(bet_list_name, bet_list_odds):
                 bet_list_obj = BetList(
                     bet_list_name=bet_list_name, 
                     odds=odd_keys,
+                    odd_entries=odd_entries,
                     earliest_match_date=min(odd_dates),
                     last_match_date=max(odd_dates)
                 )
                 session.add(bet_list_obj)
+    invalidate_result_cache()
 
+@profiled
 def drop_bet_list(bet_list_name):
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
     with Session(engine) as session: 
@@ -480,87 +2173,538 @@ def drop_bet_list(bet_list_name):
             )
             bet_list = session.scalar(existing_bet_list_statement)
             session.delete(bet_list)
+    invalidate_result_cache()
+
+BET_LIST_FILE_FORMATS = ["csv", "json", "parquet"]
+
+def read_bet_lists_file(bet_lists_file, file_format):
+    if file_format == "csv":
+        return pd.read_csv(bet_lists_file)
+    if file_format == "json":
+        return pd.read_json(bet_lists_file, orient="records")
+    if file_format == "parquet":
+        return pd.read_parquet(bet_lists_file)
+    raise NotImplementedError(
+        f"The file format should be one of {', '.join(BET_LIST_FILE_FORMATS)}"
+    )
 
-def get_bet_lists_wide_df():
+@profiled
+def export_bet_lists(file_format):
     engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-    query = """
-    with extracted_odd_keys as (
-        SELECT
-            bet_lists.bet_list_name, 
-            odd_keys.value as key
-        FROM app_db.bet_lists as bet_lists
-        JOIN json_each(bet_lists.odds) as odd_keys
-        WHERE bet_lists.last_match_date < DATE('now')
-    ),
-
-    bet_list_summary as (
-        SELECT
-            extracted_odd_keys.bet_list_name as bet_list_name,
-            matches.description as description,
-            matches.match_date as match_date,
-            competitions.name as competition,
-            (
-                matches.half_time_home_goals || '-' || matches.half_time_away_goals
-            ) as half_time_score,
-            (
-                matches.full_time_home_goals || '-' || matches.full_time_away_goals
-            ) as full_time_score,
-            odds.odd_name as odd_name,
-            odds.odd_value as odd_value,
-            odds.is_winning as is_winning,
-            extracted_odd_keys.key as key,
-            odds.odd_match_code as odd_match_code,
-            matches.competition_code as competition_code
-        FROM extracted_odd_keys
-        LEFT JOIN sporacle_db.odds as odds USING (key)
-        LEFT JOIN sporacle_db.matches as matches USING (odd_match_code)
-        LEFT JOIN sporacle_db.competitions as competitions USING (competition_code)
+    df_bet_lists = get_table_from_query(engine=engine, query=BET_LISTS_EXPORT_QUERY)
+    if file_format == "csv":
+        return df_bet_lists.to_csv(index=False).encode("utf-8")
+    if file_format == "json":
+        return df_bet_lists.to_json(orient="records").encode("utf-8")
+    if file_format == "parquet":
+        buffer = io.BytesIO()
+        df_bet_lists.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    raise NotImplementedError(
+        f"The file format should be one of {', '.join(BET_LIST_FILE_FORMATS)}"
     )
 
-    SELECT
-        bet_list_name,
-        description,
-        match_date,
-        competition,
-        half_time_score,
-        full_time_score,
-        odd_name,
-        odd_value,
-        is_winning
-    FROM bet_list_summary
-    """
+BET_LIST_FILE_REQUIRED_COLUMNS = ["bet_list_name", "key"]
+# Rejection entry of the rows that can not be attributed to a bet list
+UNNAMED_BET_LIST = "(no bet_list_name)"
+
+def get_bet_list_rejections(df_bet_list_odds, s_is_rejected, reason, detail_column):
+    # {bet_list_name: "reason: detail, detail"} for the bet lists of the rejected rows
+    return {
+        bet_list_name: f"{reason}: {', '.join(map(str, dict.fromkeys(s_details)))}"
+        for bet_list_name, s_details in (
+            df_bet_list_odds
+            .loc[s_is_rejected]
+            .groupby("bet_list_name", sort=False)[detail_column]
+        )
+    }
+
+def clean_bet_lists_file(df_file):
+    missing_columns = [
+        column for column in BET_LIST_FILE_REQUIRED_COLUMNS if column not in df_file.columns
+    ]
+    if missing_columns:
+        raise ValueError(
+            f"The bet lists file misses the column(s) {', '.join(missing_columns)}"
+        )
+    df_bet_list_odds = df_file.assign(
+        **{
+            column: df_file[column].astype("string").str.strip().replace("", pd.NA)
+            for column in BET_LIST_FILE_REQUIRED_COLUMNS
+        }
+    )
+    if "position" not in df_bet_list_odds.columns:
+        df_bet_list_odds = df_bet_list_odds.assign(
+            position=df_bet_list_odds.groupby("bet_list_name", dropna=False).cumcount()
+        )
+    s_position = pd.to_numeric(df_bet_list_odds["position"], errors="coerce")
+    return df_bet_list_odds.assign(
+        position=s_position.where(s_position.mod(1).eq(0)).astype("Int64")
+    )[["bet_list_name", "position", "key"]]
+
+@profiled
+def import_bet_lists(bet_lists_file, file_format):
+    # One row per bet list odd: bet_list_name, key and an optional position.
+    # A bet list with any invalid row (missing or unknown key, invalid or
+    # duplicate position, odd or match used twice) is rejected as a whole,
+    # the reasons are returned per bet list name.
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    df_bet_list_odds = clean_bet_lists_file(read_bet_lists_file(bet_lists_file, file_format))
+    dc_rejected_bet_lists = {}
+    s_is_unnamed = df_bet_list_odds["bet_list_name"].isna()
+    if s_is_unnamed.any():
+        dc_rejected_bet_lists[UNNAMED_BET_LIST] = f"{int(s_is_unnamed.sum())} row(s) ignored"
+    df_bet_list_odds = df_bet_list_odds.loc[~s_is_unnamed]
+
+    query, params = bind_key_set(
+        ODD_KEYS_VALIDATION_QUERY, "odd_keys", df_bet_list_odds["key"].dropna().unique()
+    )
+    df_known_odds = get_table_from_query(engine=engine, query=query, params=params)
+    df_bet_list_odds = df_bet_list_odds.merge(
+        df_known_odds.astype({"key": "string"}), on="key", how="left", validate="m:1"
+    )
+    s_has_key = df_bet_list_odds["key"].notna()
+    s_is_known = df_bet_list_odds["odd_match_code"].notna()
+    ls_checks = [
+        ("missing odd key", ~s_has_key, "position"),
+        ("invalid position", df_bet_list_odds["position"].isna(), "key"),
+        (
+            "duplicate position",
+            df_bet_list_odds["position"].notna()
+            & df_bet_list_odds.duplicated(["bet_list_name", "position"], keep=False),
+            "position"
+        ),
+        ("unknown odd keys", s_has_key & ~s_is_known, "key"),
+        (
+            "duplicate odd keys",
+            s_has_key & df_bet_list_odds.duplicated(["bet_list_name", "key"], keep=False),
+            "key"
+        ),
+        (
+            "several odds of the same match",
+            s_is_known
+            & df_bet_list_odds.duplicated(["bet_list_name", "odd_match_code"], keep=False)
+            & ~df_bet_list_odds.duplicated(["bet_list_name", "key"], keep=False),
+            "key"
+        ),
+    ]
+    for reason, s_is_rejected, detail_column in ls_checks:
+        for bet_list_name, rejection in get_bet_list_rejections(
+            df_bet_list_odds, s_is_rejected, reason, detail_column
+        ).items():
+            dc_rejected_bet_lists[bet_list_name] = "; ".join(
+                filter(None, [dc_rejected_bet_lists.get(bet_list_name), rejection])
+            )
+    df_bet_list_odds = (
+        df_bet_list_odds
+        .loc[~df_bet_list_odds["bet_list_name"].isin(dc_rejected_bet_lists.keys())]
+        .astype({"bet_list_name": str, "position": int, "key": str, "odd_match_code": int})
+        .sort_values(["bet_list_name", "position"])
+        .assign(match_date=lambda df_: pd.to_datetime(df_["match_date"]))
+    )
+    if df_bet_list_odds.empty:
+        return {"imported": 0, "rejected": dc_rejected_bet_lists}
+
+    import_date = dt.datetime.now()
+    ls_bet_lists = [
+        {
+            "bet_list_name": bet_list_name,
+            "creation_date": import_date,
+            "modification_date": import_date,
+            "odds": df_odds["key"].to_list(),
+            "earliest_match_date": df_odds["match_date"].min().to_pydatetime(),
+            "last_match_date": df_odds["match_date"].max().to_pydatetime(),
+        }
+        for bet_list_name, df_odds in df_bet_list_odds.groupby("bet_list_name")
+    ]
+    ls_bet_list_odds = (
+        df_bet_list_odds
+        [["bet_list_name", "position", "key", "odd_match_code"]]
+        .to_dict(orient="records")
+    )
+    ls_bet_list_names = [bet_list["bet_list_name"] for bet_list in ls_bet_lists]
+
+    upsert_statement = sqlite_insert(BetList.__table__)
+    upsert_statement = upsert_statement.on_conflict_do_update(
+        index_elements=["bet_list_name"],
+        set_={
+            column_name: upsert_statement.excluded[column_name]
+            for column_name in [
+                "modification_date", "odds", "earliest_match_date", "last_match_date"
+            ]
+        }
+    )
+    with engine.begin() as connection:
+        connection.execute(upsert_statement, ls_bet_lists)
+        for delete_query in [DELETE_BET_LIST_ODDS_QUERY, DELETE_BET_LIST_SETTLEMENTS_QUERY]:
+            query, params = bind_key_set(delete_query, "bet_list_names", ls_bet_list_names)
+            connection.execute(query, params)
+        connection.execute(insert(BetListOdd.__table__), ls_bet_list_odds)
+    invalidate_result_cache()
+    return {"imported": len(ls_bet_lists), "rejected": dc_rejected_bet_lists}
+
+@profiled
+@cached_result
+def get_bet_lists_wide_df():
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    query = BET_LISTS_WIDE_QUERY
     df_summary = get_table_from_query(
         engine=engine, 
         query=query
     )
     return df_summary
 
-def get_winning_and_losing_bet_lists(df_summary: pd.DataFrame) -> dict[str, bool]:
-    df_win_lose_bet_lists = (
+def get_bet_lists_evaluation(df_summary: pd.DataFrame) -> pd.DataFrame:
+    # Odds product as exp(sum(log)) so every bet list is evaluated in one groupby
+    df_evaluation = (
         df_summary
-        .groupby('bet_list_name')
-        [['is_winning']]
-        .all()
-        .reset_index()
+        .assign(
+            log_odd_value=lambda df_: np.log(df_["odd_value"].astype(float)),
+            is_losing=lambda df_: df_["is_winning"].eq(False),
+        )
+        .groupby("bet_list_name", sort=False)
+        .agg(
+            log_odds_product=("log_odd_value", "sum"),
+            match_count=("description", "count"),
+            losing_match_count=("is_losing", "sum"),
+        )
+    )
+    return (
+        df_evaluation
+        .assign(
+            odds_product=lambda df_: np.exp(df_["log_odds_product"]),
+            is_winning=lambda df_: df_["losing_match_count"].eq(0),
+        )
+        [["odds_product", "match_count", "losing_match_count", "is_winning"]]
+    )
+
+@profiled
+def settle_bet_lists():
+    # Only lists that just got all their results are evaluated, settled ones never change
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    df_unsettled = get_table_from_query(
+        engine=engine,
+        query=UNSETTLED_BET_LISTS_WIDE_QUERY
+    )
+    if df_unsettled.empty:
+        return 0
+    df_evaluation = get_bet_lists_evaluation(df_unsettled)
+    settlement_date = dt.datetime.now()
+    with Session(engine) as session:
+        with session.begin():
+            session.add_all(
+                [
+                    BetListSettlement(
+                        bet_list_name=bet_list.Index,
+                        is_winning=bool(bet_list.is_winning),
+                        odds_product=float(bet_list.odds_product),
+                        match_count=int(bet_list.match_count),
+                        losing_match_count=int(bet_list.losing_match_count),
+                        settlement_date=settlement_date
+                    )
+                    for bet_list in df_evaluation.itertuples()
+                ]
+            )
+    invalidate_result_cache()
+    return len(df_evaluation)
+
+@profiled
+@cached_result
+def get_settled_bet_lists(is_winning, page=0, page_size=SETTLED_BET_LISTS_PAGE_SIZE):
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    df_settled = get_table_from_query(
+        engine=engine,
+        query=SETTLED_BET_LISTS_QUERY,
+        params={"is_winning": is_winning, "limit": page_size, "offset": page * page_size},
+        dtypes={"odds_product": "float"}
+    )
+    return (
+        df_settled
+        .astype({"is_winning": bool, "match_count": int, "losing_match_count": int})
+        .set_index("bet_list_name")
+    )
+
+@profiled
+def get_settled_bet_lists_count() -> dict[str, int]:
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    with engine.connect() as connection:
+        row = connection.execute(text(SETTLED_BET_LISTS_COUNT_QUERY)).one()
+    return {"winning": int(row.winning), "losing": int(row.losing)}
+
+@profiled
+@cached_result
+def get_bet_list_legs(bet_list_names):
+    # Only the legs of the bet lists shown are read, whatever the history size
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    query, params = bind_key_set(BET_LIST_LEGS_QUERY, "bet_list_names", list(bet_list_names))
+    return get_table_from_query(engine=engine, query=query, params=params)
+
+#endregion
+
+
+#region System bets
+SYSTEM_BET_CHUNK_SIZE = 50_000
+SYSTEM_BET_RANKINGS = ["odds_product", "expected_value"]
+
+def iter_combination_chunks(pool_size, combination_size, chunk_size=SYSTEM_BET_CHUNK_SIZE):
+    # Yields (chunk_size, combination_size) index arrays, the full set of
+    # combinations is never materialized.
+    combinations = itertools.combinations(range(pool_size), combination_size)
+    combination_dtype = np.dtype((np.int16, combination_size))
+    while True:
+        ar_chunk = np.fromiter(
+            itertools.islice(combinations, chunk_size),
+            dtype=combination_dtype
+        )
+        if ar_chunk.shape[0] == 0:
+            return
+        yield ar_chunk
+
+def drop_same_match_combinations(ar_combinations, ar_match_codes):
+    # Two odds of the same match can not be part of one accumulator
+    ar_combination_match_codes = np.sort(ar_match_codes[ar_combinations], axis=1)
+    ar_is_valid = ~(
+        ar_combination_match_codes[:, 1:] == ar_combination_match_codes[:, :-1]
+    ).any(axis=1)
+    return ar_combinations[ar_is_valid]
+
+def keep_top_combinations(ar_scores, ar_combinations, top_n):
+    if ar_scores.shape[0] <= top_n:
+        return ar_scores, ar_combinations
+    ar_top = np.argpartition(-ar_scores, top_n - 1)[:top_n]
+    return ar_scores[ar_top], ar_combinations[ar_top]
+
+@profiled
+def get_top_system_bet_combinations(
+    df_pool,
+    combination_size,
+    top_n=100,
+    rank_by="odds_product",
+    chunk_size=SYSTEM_BET_CHUNK_SIZE
+):
+    # df_pool holds one row per candidate odd with at least key, odd_value and
+    # odd_match_code. Expected values need a probability column estimated
+    # independently of the odds: the book's own margin free probabilities give
+    # every combination the same expected value.
+    if rank_by not in SYSTEM_BET_RANKINGS:
+        raise NotImplementedError(
+            f"rank_by should be one of {', '.join(SYSTEM_BET_RANKINGS)}"
+        )
+    if rank_by == "expected_value" and "probability" not in df_pool.columns:
+        raise ValueError("Ranking by expected value needs a probability column")
+    df_pool = df_pool.reset_index(drop=True)
+    pool_size = df_pool.shape[0]
+    if not 0 < combination_size <= pool_size:
+        raise ValueError(
+            f"The combination size should be between 1 and {pool_size}"
+        )
+    ar_odd_values = df_pool["odd_value"].to_numpy(dtype=np.float64)
+    ar_match_codes = df_pool["odd_match_code"].to_numpy(dtype=np.int64)
+    if "probability" in df_pool.columns:
+        ar_probabilities = df_pool["probability"].to_numpy(dtype=np.float64)
+    else:
+        ar_probabilities = np.full(pool_size, np.nan)
+
+    ar_top_scores = np.empty(0)
+    ar_top_combinations = np.empty((0, combination_size), dtype=np.int16)
+    for ar_combinations in iter_combination_chunks(pool_size, combination_size, chunk_size):
+        ar_combinations = drop_same_match_combinations(ar_combinations, ar_match_codes)
+        ar_scores = ar_odd_values[ar_combinations].prod(axis=1)
+        if rank_by == "expected_value":
+            ar_scores = ar_scores * ar_probabilities[ar_combinations].prod(axis=1)
+        ar_top_scores, ar_top_combinations = keep_top_combinations(
+            np.concatenate([ar_top_scores, ar_scores]),
+            np.concatenate([ar_top_combinations, ar_combinations]),
+            top_n
+        )
+
+    ar_top_combinations = ar_top_combinations[np.argsort(-ar_top_scores, kind="stable")]
+    ar_odds_products = ar_odd_values[ar_top_combinations].prod(axis=1)
+    ar_keys = df_pool["key"].to_numpy()
+    return pd.DataFrame(
+        {
+            "keys": [ar_keys[combination].tolist() for combination in ar_top_combinations],
+            "positions": [combination.tolist() for combination in ar_top_combinations],
+            "odds_product": ar_odds_products,
+            "expected_value": (
+                ar_odds_products * ar_probabilities[ar_top_combinations].prod(axis=1)
+            ),
+        }
+    )
+
+@profiled
+def save_system_bet_combinations(bet_list_name, df_pool, df_combinations):
+    # Each combination is stored as its own bet list: "<name> #<rank>"
+    ls_pool_odds = df_pool.reset_index(drop=True).to_dict(orient="records")
+    ls_bet_list_names = []
+    for rank, combination in enumerate(df_combinations.itertuples(), start=1):
+        combination_bet_list_name = f"{bet_list_name} #{rank}"
+        upsert_bet_list(
+            combination_bet_list_name,
+            [ls_pool_odds[position] for position in combination.positions]
+        )
+        ls_bet_list_names.append(combination_bet_list_name)
+    return ls_bet_list_names
+
+#endregion
+
+#region Backtesting
+# A strategy bets every accumulator of `legs` odds, one odd per match, that can
+# be built each match day from the `max_odds_per_day` shortest qualifying odds.
+BACKTEST_DEFAULT_STRATEGY = {
+    "competition_codes": None,
+    "odd_names": None,
+    "min_odd_value": 1.0,
+    "max_odd_value": 100.0,
+    "legs": 3,
+    "max_odds_per_day": 30,
+    "stake": 1.0,
+}
+
+# Seasons start in July
+SEASON_START_MONTH = 7
+
+def get_season(s_match_date):
+    return s_match_date.dt.year - (s_match_date.dt.month < SEASON_START_MONTH)
+
+@profiled
+def get_backtest_odds(dc_strategy):
+    engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
+    df_odds = get_table_from_query(
+        engine=engine,
+        query=BACKTEST_ODDS_QUERY,
+        params={
+            "min_odd_value": dc_strategy["min_odd_value"],
+            "max_odd_value": dc_strategy["max_odd_value"],
+        },
+        dtypes=ODDS_DTYPES
+    )
+    if dc_strategy["competition_codes"]:
+        df_odds = df_odds[df_odds["competition_code"].isin(dc_strategy["competition_codes"])]
+    if dc_strategy["odd_names"]:
+        df_odds = df_odds[df_odds["odd_name"].isin(dc_strategy["odd_names"])]
+    s_match_date = pd.to_datetime(df_odds["match_date"])
+    return df_odds.assign(
+        is_winning=df_odds["is_winning"].astype(bool),
+        match_day=s_match_date.dt.normalize(),
+        season=get_season(s_match_date),
     )
-    dc_win_lost_bet_lists = {
-        dc_["bet_list_name"]:dc_["is_winning"]
-        for dc_ in df_win_lose_bet_lists.to_dict(orient="records")
+
+def get_elementary_symmetric_sum(ar_values, k):
+    # Sum over every k-subset of ar_values of the product of its values, built
+    # one value at a time: e_j += value * e_(j-1)
+    ar_sums = np.zeros(k + 1, dtype=ar_values.dtype)
+    ar_sums[0] = 1
+    for value in ar_values:
+        ar_sums[1:] = ar_sums[1:] + value * ar_sums[:-1]
+    return ar_sums[k]
+
+def backtest_match_day(df_day_odds, dc_strategy):
+    # Bet lists take one odd from `legs` different matches of the pool, so with
+    # per match odd counts n_m, winning odd counts w_m and winning odd value
+    # sums r_m, the day totals are the elementary symmetric sums of n, w and r.
+    # Bet lists are never enumerated.
+    df_pool = (
+        df_day_odds
+        .sort_values("odd_value", kind="stable")
+        .head(dc_strategy["max_odds_per_day"])
+    )
+    ar_odd_values = df_pool["odd_value"].to_numpy(dtype=np.float64)
+    ar_is_winning = df_pool["is_winning"].to_numpy(dtype=bool)
+    _, ar_match_positions = np.unique(
+        df_pool["odd_match_code"].to_numpy(dtype=np.int64), return_inverse=True
+    )
+    legs = dc_strategy["legs"]
+    bet_list_count = int(get_elementary_symmetric_sum(
+        np.bincount(ar_match_positions), legs
+    ))
+    winning_count = int(get_elementary_symmetric_sum(
+        np.bincount(ar_match_positions, weights=ar_is_winning).astype(np.int64), legs
+    ))
+    returns = float(get_elementary_symmetric_sum(
+        np.bincount(ar_match_positions, weights=ar_odd_values * ar_is_winning), legs
+    ))
+    return {
+        "bet_list_count": bet_list_count,
+        "winning_count": winning_count,
+        "stakes": bet_list_count * dc_strategy["stake"],
+        "returns": returns * dc_strategy["stake"],
     }
-    return dc_win_lost_bet_lists
 
-def get_winning_and_losing_bet_lists_count(
-    dc_win_lost_bet_lists: dict[str, bool]
-) -> dict[str, int]:
-    win_bet_lists_count = sum(
-        [1 for x,y in dc_win_lost_bet_lists.items() if y == True ]
+BACKTEST_DAY_COLUMNS = ["match_day", "bet_list_count", "winning_count", "stakes", "returns"]
+BACKTEST_SEASON_COLUMNS = [
+    "bet_list_count", "winning_count", "hit_rate", "stakes", "returns", "roi", "max_drawdown"
+]
+
+def backtest_season(df_season_odds, dc_strategy):
+    # Runs in worker processes: only takes and returns picklable frames
+    return pd.DataFrame(
+        [
+            {"match_day": match_day} | backtest_match_day(df_day_odds, dc_strategy)
+            for match_day, df_day_odds in df_season_odds.groupby("match_day")
+        ],
+        columns=BACKTEST_DAY_COLUMNS
     )
-    lose_bet_list_count = sum(
-        [1 for x,y in dc_win_lost_bet_lists.items() if y == False ]
+
+def get_backtest_metrics(df_days):
+    stakes = df_days["stakes"].sum()
+    s_profit = (df_days["returns"] - df_days["stakes"]).cumsum()
+    s_drawdown = s_profit.cummax().clip(lower=0) - s_profit
+    bet_list_count = df_days["bet_list_count"].sum()
+    return {
+        "bet_list_count": int(bet_list_count),
+        "winning_count": int(df_days["winning_count"].sum()),
+        # Nothing bet: no hit and no return on investment
+        "hit_rate": df_days["winning_count"].sum() / bet_list_count if bet_list_count else 0.0,
+        "stakes": stakes,
+        "returns": df_days["returns"].sum(),
+        "roi": (df_days["returns"].sum() - stakes) / stakes if stakes else 0.0,
+        "max_drawdown": s_drawdown.max() if not s_drawdown.empty else 0.0,
+    }
+
+@profiled
+def run_backtest(dc_strategy=None, max_workers=None):
+    # Seasons are replayed in parallel processes where the platform allows it,
+    # Pyodide has no subprocesses so they run one after the other there.
+    dc_strategy = BACKTEST_DEFAULT_STRATEGY | (dc_strategy or {})
+    df_odds = get_backtest_odds(dc_strategy)
+    dc_season_odds = dict(tuple(df_odds.groupby("season")))
+    if sys.platform == "emscripten" or len(dc_season_odds) < 2:
+        ls_df_seasons = [
+            backtest_season(df_season_odds, dc_strategy)
+            for df_season_odds in dc_season_odds.values()
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            ls_df_seasons = list(
+                executor.map(
+                    backtest_season,
+                    dc_season_odds.values(),
+                    [dc_strategy] * len(dc_season_odds)
+                )
+            )
+    ls_df_days = [
+        df_season_days.assign(season=season)
+        for season, df_season_days in zip(dc_season_odds, ls_df_seasons)
+    ]
+    df_days = (
+        pd.concat(ls_df_days, ignore_index=True) if ls_df_days
+        else pd.DataFrame(columns=[*BACKTEST_DAY_COLUMNS, "season"])
     )
+    df_seasons = pd.DataFrame.from_dict(
+        {
+            season: get_backtest_metrics(df_season_days)
+            for season, df_season_days in df_days.groupby("season")
+        },
+        orient="index",
+        columns=BACKTEST_SEASON_COLUMNS
+    ).rename_axis("season").astype({"bet_list_count": int, "winning_count": int})
     return {
-        "winning":win_bet_lists_count, "losing":lose_bet_list_count
+        "metrics": get_backtest_metrics(df_days),
+        "df_seasons": df_seasons,
+        "df_days": df_days.assign(
+            profit=lambda df_: (df_["returns"] - df_["stakes"]).cumsum()
+        ),
     }
 
 #endregion
-
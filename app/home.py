@@ -1,12 +1,16 @@
 from app_session import SessionKey, setup_bet_lists_in_session
 import streamlit as st
 import data
-from data import IN_MEMORY_SQLALCHEMY_DB_ENGINE
 import pyodide
 
+import json
+import sqlite3
+import zlib
 import requests as rq
 import pandas as pd
 
+SPORACLE_DATA_URL = 'https://raw.githubusercontent.com/SPORTS-DDD/sporacle_app/refs/heads/database/data'
+
 
 
 #region Functions
@@ -17,22 +21,108 @@ async def download_file_as_bytes(url):
     return data_in_bytes
 
 
+async def iter_download_chunks(url):
+    response = await pyodide.http.pyfetch(url)
+    reader = response.js_response.body.getReader()
+    while True:
+        chunk = await reader.read()
+        if chunk.done:
+            break
+        yield chunk.value.to_bytes()
+
+
+async def download_full_sporacle_db(manifest):
+    if manifest.get("database_sha256"):
+        try:
+            await data.initial_app_setup_from_stream(
+                iter_download_chunks(f'{SPORACLE_DATA_URL}/database.db.gz'),
+                manifest["database_sha256"]
+            )
+            return
+        except (ValueError, zlib.error):
+            pass
+    sporacle_bytes_data = await download_file_as_bytes(f'{SPORACLE_DATA_URL}/database.db')
+    data.initial_app_setup(sporacle_bytes_data)
+
+
+async def download_manifest():
+    try:
+        return json.loads(
+            await download_file_as_bytes(f'{SPORACLE_DATA_URL}/manifest.json')
+        )
+    except ValueError:
+        return {"version": None, "deltas": []}
+
+
+async def sync_sporacle_db():
+    manifest = await download_manifest()
+    ls_delta_paths = data.get_delta_chain(manifest, data.get_sporacle_db_version())
+    if ls_delta_paths is None:
+        await download_full_sporacle_db(manifest)
+    else:
+        ls_sporacle_deltas = [
+            await download_file_as_bytes(f'{SPORACLE_DATA_URL}/{delta_path}')
+            for delta_path in ls_delta_paths
+        ]
+        await data.delta_app_setup_or_fallback(
+            ls_sporacle_deltas,
+            lambda: download_full_sporacle_db(manifest)
+        )
+
+
 @st.dialog('Upload local DB')
 def display_upload_db_dialog():
     uploaded_file = st.file_uploader('Import a local DB file')
     if uploaded_file is not None:
-        data.add_uploaded_db_file(uploaded_file)
-        st.success('Database successfully imported. Please close this dialog.')
+        try:
+            with st.spinner('Checking and migrating the uploaded database...'):
+                data.add_uploaded_db_file(uploaded_file)
+        except (ValueError, sqlite3.DatabaseError) as e:
+            st.error(f'The database was not imported, your current local DB is unchanged. {e}')
+        else:
+            st.success('Database successfully imported. Please close this dialog.')
         
 
 @st.dialog('Download local DB')
 def display_download_db_dialog():
-    with open('local.database.db', 'rb') as f:
-        data = f.read()
+    compress = st.checkbox('Compress (gzip)', value=True)
+    export_file_name = 'local.database.db.gz' if compress else 'local.database.db'
+    export_path = data.export_local_db(f'export.{export_file_name}', compress=compress)
+    with open(export_path, 'rb') as f:
+        st.download_button(
+            label='Download local DB', 
+            data=f,
+            file_name=export_file_name
+        )
+
+@st.dialog('Import bet lists')
+def display_import_bet_lists_dialog():
+    st.caption(
+        'One row per odd with the columns bet_list_name, key and optionally position. '
+        'Existing bet lists with the same name are replaced.'
+    )
+    file_format = st.selectbox('File format', data.BET_LIST_FILE_FORMATS)
+    uploaded_file = st.file_uploader('Import a bet lists file', type=[file_format])
+    # Imported on click only, not again on every rerun while the file stays uploaded
+    if uploaded_file is not None and st.button('Import'):
+        try:
+            dc_import_result = data.import_bet_lists(uploaded_file, file_format)
+        except ValueError as e:
+            st.error(f'The bet lists file was not imported. {e}')
+            return
+        st.success(f"{dc_import_result['imported']} bet list(s) imported.")
+        if dc_import_result['rejected']:
+            st.warning('Some bet lists were rejected, none of their odds were imported:')
+            st.json(dc_import_result['rejected'])
+
+
+@st.dialog('Export bet lists')
+def display_export_bet_lists_dialog():
+    file_format = st.selectbox('File format', data.BET_LIST_FILE_FORMATS)
     st.download_button(
-        label='Download local DB', 
-        data=data,
-        file_name="local.database.db"
+        label='Download bet lists',
+        data=data.export_bet_lists(file_format),
+        file_name=f'bet_lists.{file_format}'
     )
 
 @st.fragment
@@ -40,20 +130,91 @@ def display_query_form():
     with st.expander('Query databases'):
         selected_db = st.selectbox(
             label='What database do you want to query ?', 
-            options=["Sporacle", "Local DB", "Cross-Database"]
+            options=data.QUERY_CONSOLE_DATABASES
         )
-        if selected_db == "Sporacle":
-            engine = data.get_sqlalchemy_sporacle_engine()
-        elif selected_db == "Local DB":
-            engine = data.get_sqlalchemy_local_db_engine()
-        elif selected_db == "Cross-Database":
-            engine = IN_MEMORY_SQLALCHEMY_DB_ENGINE
-        else:
-            raise NotImplementedError("The database should be either Sporacle or Local DB")
+        row_cap_col, time_budget_col, page_col = st.columns(3)
+        row_cap = row_cap_col.number_input(
+            'Row limit',
+            min_value=1,
+            value=data.QUERY_CONSOLE_ROW_CAP,
+            step=1000
+        )
+        time_budget = time_budget_col.number_input(
+            'Time budget (s)',
+            min_value=0.5,
+            value=data.QUERY_CONSOLE_TIME_BUDGET,
+            step=0.5
+        )
+        page = page_col.number_input('Page', min_value=1, value=1, step=1)
         query = st.text_area(f"Query to {selected_db}")
         if query:
-            df = data.get_table_from_query(engine, query)
-            st.write(df)
+            dc_result = data.run_guarded_query(
+                selected_db,
+                query,
+                page=page - 1,
+                row_cap=row_cap,
+                time_budget=time_budget
+            )
+            page_count = max(1, -(-dc_result["row_count"] // data.QUERY_CONSOLE_PAGE_SIZE))
+            st.caption(
+                f'{dc_result["row_count"]}{"+" if dc_result["is_capped"] else ""} rows'
+                f' in {dc_result["elapsed"]:.3f}s  -  page {page}/{page_count}'
+            )
+            if dc_result["is_interrupted"]:
+                st.warning(f'Query stopped after its {time_budget}s time budget')
+            st.dataframe(dc_result["df_page"])
+            if st.button('Export full result as CSV'):
+                export_path = 'query_export.csv'
+                dc_export = data.export_guarded_query(selected_db, query, export_path)
+                if dc_export["is_interrupted"]:
+                    st.warning(
+                        f'Export stopped after its {data.QUERY_CONSOLE_EXPORT_TIME_BUDGET}s '
+                        f'time budget ({dc_export["row_count"]} rows written), nothing to download'
+                    )
+                else:
+                    with open(export_path, 'rb') as f:
+                        st.download_button(
+                            label=f'Download {dc_export["row_count"]} rows',
+                            data=f,
+                            file_name=export_path,
+                            mime='text/csv'
+                        )
+
+@st.fragment
+def display_diagnostics():
+    with st.expander('Diagnostics'):
+        is_enabled = st.toggle('Record timings', value=data.is_profiling_enabled())
+        data.enable_profiling(is_enabled)
+        df_records = data.get_profiling_records()
+        if df_records.empty:
+            st.info('No timing recorded yet')
+            return
+        if st.button('Clear timings'):
+            data.clear_profiling_records()
+            st.rerun(scope="fragment")
+        st.markdown('**Wall time percentiles (s)**')
+        st.dataframe(data.get_profiling_summary(df_records), hide_index=True)
+        st.markdown('**Slowest recent calls**')
+        df_slowest = df_records.nlargest(10, 'wall_time')
+        st.dataframe(
+            df_slowest.drop(columns=['params']),
+            hide_index=True,
+            column_config={"sql": None}
+        )
+        df_slowest_sql = df_slowest.dropna(subset=['sql'])
+        if not df_slowest_sql.empty:
+            explained_index = st.selectbox(
+                'Explain query plan of',
+                options=df_slowest_sql.index.to_list(),
+                format_func=lambda index: (
+                    f"{df_slowest_sql.loc[index, 'name']} "
+                    f"({df_slowest_sql.loc[index, 'wall_time']:.3f}s)"
+                )
+            )
+            if st.button('Explain'):
+                explained_call = df_slowest_sql.loc[explained_index]
+                st.code(explained_call.sql, language='sql')
+                st.write(data.explain_query(explained_call.sql, explained_call.params))
 #endregion
 
 
@@ -63,10 +224,7 @@ if (
     not SessionKey.LOCAL_DB_INITIALIZED.is_in_session() and
     not SessionKey.SPORACLE_DB_DOWNLOADED.is_in_session()
 ):
-    
-    URL = 'https://raw.githubusercontent.com/SPORTS-DDD/sporacle_app/refs/heads/database/data/database.db'
-    sporacle_bytes_data = await download_file_as_bytes(URL) #noqa
-    data.initial_app_setup(sporacle_bytes_data)
+    await sync_sporacle_db() #noqa
     st.success('Database successfully initialized')
 
 setup_bet_lists_in_session()
@@ -84,5 +242,13 @@ with st.expander('Database Management'):
         if download_col.button('Download local DB'):
             display_download_db_dialog()
 
+    if SessionKey.LOCAL_DB_INITIALIZED.is_in_session():
+        import_col, export_col, _ = st.columns(3)
+        if import_col.button('Import bet lists'):
+            display_import_bet_lists_dialog()
+        if export_col.button('Export bet lists'):
+            display_export_bet_lists_dialog()
+
 
-display_query_form()
\ No newline at end of file
+display_query_form()
+display_diagnostics()
@@ -13,6 +13,7 @@ home_page = st.Page("home.py", title="Home", icon=":material/home:")
 at_term_bet_lists = st.Page("bet_lists/at_term_bet_lists.py", title="At-term bet lists", icon=":material/fact_check:")
 search_bet_lists = st.Page("bet_lists/search_bet_lists.py", title="Search on-going bet lists", icon=":material/search:")
 # bet_lists_page = st.Page("bet_lists/bet_lists.py", title="Bet Lists", icon=":material/table:")
+backtest_strategy_page = st.Page("bet_lists/backtest_strategy.py", title="Backtest a strategy", icon=":material/query_stats:")
 create_update_bet_list_page = st.Page("bet_lists/create_update_bet_list.py", title="Create/Update bet list", icon=":material/edit_note:")
 # new_bet_list_page = st.Page("bet_lists/new_bet_list.py", title="Create new bet list", icon=":material/format_list_numbered_rtl:")
 # saved_bet_lists_page = st.Page("bet_lists/saved_bet_lists.py", title="Saved bet lists", icon=":material/database:")
@@ -26,6 +27,7 @@ pg = st.navigation(
             search_bet_lists,
             create_update_bet_list_page,
             at_term_bet_lists,
+            backtest_strategy_page,
             # new_bet_list_page, 
             # saved_bet_lists_page, 
             # update_bet_list_page
@@ -38,4 +40,5 @@ pg = st.navigation(
 
 #endregion
 
-pg.run()
+with data.profile_section("page", pg.title):
+    pg.run()
@@ -0,0 +1,135 @@
+import datetime as dt
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "app"))
+
+import data  # noqa: E402
+import synthetic_data  # noqa: E402
+
+
+def get_proc_status_kib(field):
+    # Linux only: None where /proc/self/status does not exist
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM (peak RSS) to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(func, repeat, setup=None):
+    # tracemalloc only sees Python allocations, the Arrow, NumPy and SQLite
+    # buffers the queries live in are covered by the peak RSS growth.
+    ls_times = []
+    peak_memory = 0
+    peak_rss = 0
+    is_rss_measured = True
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        is_rss_measured = reset_peak_rss() and is_rss_measured
+        rss_before = get_proc_status_kib("VmRSS")
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        ls_times.append(time.perf_counter() - start)
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        rss_after = get_proc_status_kib("VmHWM")
+        if rss_before is not None and rss_after is not None:
+            peak_rss = max(peak_rss, rss_after - rss_before)
+    return {
+        "median_ms": statistics.median(ls_times) * 1000,
+        "min_ms": min(ls_times) * 1000,
+        "peak_mib": peak_memory / 2**20,
+        "peak_rss_mib": peak_rss / 2**10 if is_rss_measured else float("nan"),
+    }
+
+
+def get_benchmarks():
+    # Built lazily: inputs depend on the generated data
+    df_future_odds = data.get_future_odds()
+    ls_keys = data.get_table_from_query(
+        data.IN_MEMORY_SQLALCHEMY_DB_ENGINE,
+        "SELECT key FROM sporacle_db.odds LIMIT 500"
+    )["key"].to_list()
+    ls_bet_list_odds = [
+        {"key": key, "odd_match_code": int(key.split("_")[0]), "match_datetime": dt.datetime.now()}
+        for key in ls_keys[:10]
+    ]
+    cold = data.invalidate_result_cache
+    return {
+        "get_program (cold)": (data.get_program, cold),
+        "get_program (cached)": (data.get_program, None),
+        "clean_odds": (lambda: data.clean_odds(df_future_odds), None),
+        "get_bet_lists_wide_df (cold)": (data.get_bet_lists_wide_df, cold),
+        "get_bet_lists_evaluation": (
+            lambda: data.get_bet_lists_evaluation(data.get_bet_lists_wide_df()), None
+        ),
+        "upsert_bet_list": (
+            lambda: data.upsert_bet_list("Benchmark bet list", ls_bet_list_odds), None
+        ),
+        "get_existing_bet_list_summary (10 keys)": (
+            lambda: data.get_existing_bet_list_summary(ls_keys[:10]), None
+        ),
+        "get_existing_bet_list_summary (500 keys)": (
+            lambda: data.get_existing_bet_list_summary(ls_keys), None
+        ),
+    }
+
+
+def run(folder, repeat, **generate_kwargs):
+    os.chdir(folder)
+    dc_sizes = synthetic_data.generate(folder=".", **generate_kwargs)
+    print(", ".join(f"{count} {table}" for table, count in dc_sizes.items()))
+    data.reset_engines()
+    data.invalidate_result_cache()
+    data.init_database()
+    print(
+        f"{'benchmark':<45}{'median ms':>12}{'min ms':>12}"
+        f"{'py peak MiB':>14}{'RSS peak MiB':>14}"
+    )
+    for name, (func, setup) in get_benchmarks().items():
+        dc_result = measure(func, repeat, setup)
+        print(
+            f"{name:<45}{dc_result['median_ms']:>12.2f}"
+            f"{dc_result['min_ms']:>12.2f}{dc_result['peak_mib']:>14.2f}"
+            f"{dc_result['peak_rss_mib']:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = synthetic_data.get_parser()
+    parser.description = "Benchmark data.py hot paths on synthetic sporacle data"
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        run(
+            folder=args.folder if args.folder != "." else tmp_folder,
+            repeat=args.repeat,
+            seasons=args.seasons,
+            competitions=args.competitions,
+            matches_per_competition=args.matches_per_competition,
+            markets_per_match=args.markets_per_match,
+            bet_lists=args.bet_lists,
+            legs_per_bet_list=args.legs_per_bet_list,
+            seed=args.seed,
+        )
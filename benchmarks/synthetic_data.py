@@ -0,0 +1,202 @@
+import argparse
+import datetime as dt
+import os
+import pathlib
+import random
+import sys
+
+from sqlalchemy import create_engine, event, insert
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "app"))
+
+from data import (  # noqa: E402
+    Base,
+    BetList,
+    BetListOdd,
+    Competition,
+    LOCAL_DB_SCHEMA_VERSION,
+    Match,
+    Odd,
+    PROGRAM_ODDS_COLUMNS,
+)
+
+TEAMS_PER_COMPETITION = 20
+INSERT_BATCH_SIZE = 20_000
+
+
+def is_winning_odd(odd_name, home_goals, away_goals):
+    if home_goals is None:
+        return None
+    total_goals = home_goals + away_goals
+    outcome = "1" if home_goals > away_goals else "2" if home_goals < away_goals else "X"
+    if odd_name in ("1", "X", "2"):
+        return odd_name == outcome
+    if odd_name in ("1X", "X2", "12"):
+        return outcome in odd_name
+    sign, threshold = odd_name.split()[:2]
+    return total_goals < float(threshold) if sign == "-" else total_goals > float(threshold)
+
+
+def get_db_engine(sporacle_db_path, local_db_path):
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def attach_dbs(dbapi_connection, connection_record):
+        cursor_obj = dbapi_connection.cursor()
+        cursor_obj.execute(f"attach '{sporacle_db_path}' as sporacle_db;")
+        cursor_obj.execute(f"attach '{local_db_path}' as app_db;")
+        cursor_obj.close()
+
+    return engine
+
+
+def insert_in_batches(connection, table, rows):
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        connection.execute(insert(table), rows[i:i + INSERT_BATCH_SIZE])
+
+
+def generate(
+    folder=".",
+    seasons=3,
+    competitions=10,
+    matches_per_competition=380,
+    markets_per_match=len(PROGRAM_ODDS_COLUMNS),
+    bet_lists=1_000,
+    legs_per_bet_list=5,
+    future_days=14,
+    seed=0,
+):
+    rng = random.Random(seed)
+    folder = pathlib.Path(folder)
+    sporacle_db_path = folder / "database.db"
+    local_db_path = folder / "local.database.db"
+    for db_path in (sporacle_db_path, local_db_path):
+        if db_path.exists():
+            os.remove(db_path)
+
+    today = dt.datetime.now().replace(minute=0, second=0, microsecond=0)
+    first_date = today - dt.timedelta(days=365 * seasons)
+    date_range_hours = int((today + dt.timedelta(days=future_days) - first_date).total_seconds() // 3600)
+    market_names = PROGRAM_ODDS_COLUMNS[:markets_per_match]
+
+    ls_competitions = []
+    ls_matches = []
+    ls_odds = []
+    odd_match_code = 0
+    for competition_code in range(1, competitions + 1):
+        ls_competitions.append(
+            {
+                "competition_code": competition_code,
+                "name": f"Competition {competition_code}",
+                "is_top_competition": competition_code <= competitions // 2,
+            }
+        )
+        teams = [f"Team {competition_code}-{team}" for team in range(TEAMS_PER_COMPETITION)]
+        for _ in range(matches_per_competition * seasons):
+            odd_match_code += 1
+            home_team, away_team = rng.sample(teams, 2)
+            match_date = first_date + dt.timedelta(hours=rng.randrange(date_range_hours))
+            is_played = match_date < today
+            home_goals = rng.choice([0, 0, 1, 1, 1, 2, 2, 3, 4]) if is_played else None
+            away_goals = rng.choice([0, 0, 1, 1, 2, 2, 3]) if is_played else None
+            ls_matches.append(
+                {
+                    "odd_match_code": odd_match_code,
+                    "competition_code": competition_code,
+                    "match_date": match_date,
+                    "description": f"{home_team} - {away_team}",
+                    "sport_radar_match_code": None,
+                    "home_team": home_team,
+                    "away_team": away_team,
+                    "half_time_home_goals": None if home_goals is None else home_goals // 2,
+                    "half_time_away_goals": None if away_goals is None else away_goals // 2,
+                    "full_time_home_goals": home_goals,
+                    "full_time_away_goals": away_goals,
+                }
+            )
+            for odd_name in market_names:
+                ls_odds.append(
+                    {
+                        "key": f"{odd_match_code}_{odd_name}",
+                        "odd_name": odd_name,
+                        "odd_value": round(rng.uniform(1.05, 8.0), 2),
+                        "odd_threshold": None,
+                        "is_winning": is_winning_odd(odd_name, home_goals, away_goals),
+                        "odd_match_code": odd_match_code,
+                    }
+                )
+
+    ls_bet_lists = []
+    ls_bet_list_odds = []
+    for bet_list_index in range(bet_lists):
+        bet_list_name = f"Bet list {bet_list_index}"
+        ls_legs = rng.sample(ls_matches, legs_per_bet_list)
+        ls_dates = [match["match_date"] for match in ls_legs]
+        ls_keys = [
+            f"{match['odd_match_code']}_{rng.choice(market_names)}" for match in ls_legs
+        ]
+        ls_bet_lists.append(
+            {
+                "bet_list_name": bet_list_name,
+                "odds": ls_keys,
+                "earliest_match_date": min(ls_dates),
+                "last_match_date": max(ls_dates),
+            }
+        )
+        ls_bet_list_odds.extend(
+            {
+                "bet_list_name": bet_list_name,
+                "position": position,
+                "key": key,
+                "odd_match_code": match["odd_match_code"],
+            }
+            for position, (key, match) in enumerate(zip(ls_keys, ls_legs))
+        )
+
+    engine = get_db_engine(sporacle_db_path, local_db_path)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        insert_in_batches(connection, Competition.__table__, ls_competitions)
+        insert_in_batches(connection, Match.__table__, ls_matches)
+        insert_in_batches(connection, Odd.__table__, ls_odds)
+        insert_in_batches(connection, BetList.__table__, ls_bet_lists)
+        insert_in_batches(connection, BetListOdd.__table__, ls_bet_list_odds)
+        connection.exec_driver_sql(f"PRAGMA app_db.user_version = {LOCAL_DB_SCHEMA_VERSION};")
+    engine.dispose()
+    return {
+        "competitions": len(ls_competitions),
+        "matches": len(ls_matches),
+        "odds": len(ls_odds),
+        "bet_lists": len(ls_bet_lists),
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic database.db and local.database.db"
+    )
+    parser.add_argument("--folder", default=".")
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--competitions", type=int, default=10)
+    parser.add_argument("--matches-per-competition", type=int, default=380)
+    parser.add_argument("--markets-per-match", type=int, default=len(PROGRAM_ODDS_COLUMNS))
+    parser.add_argument("--bet-lists", type=int, default=1_000)
+    parser.add_argument("--legs-per-bet-list", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    print(
+        generate(
+            folder=args.folder,
+            seasons=args.seasons,
+            competitions=args.competitions,
+            matches_per_competition=args.matches_per_competition,
+            markets_per_match=args.markets_per_match,
+            bet_lists=args.bet_lists,
+            legs_per_bet_list=args.legs_per_bet_list,
+            seed=args.seed,
+        )
+    )
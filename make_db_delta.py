@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import json
+import pathlib
+import shutil
+import sqlite3
+import sys
+
+# Tables shipped to the app, with the primary key used to match rows
+SYNCED_TABLES = {
+    "competitions": "competition_code",
+    "matches": "odd_match_code",
+    "odds": "key",
+}
+MAX_DELTAS = 30
+MANIFEST_FILE_NAME = "manifest.json"
+COMPRESSED_DB_FILE_NAME = "database.db.gz"
+CHUNK_SIZE = 1024 * 1024
+DELTAS_FOLDER_NAME = "deltas"
+
+
+def get_version(db_path):
+    if not pathlib.Path(db_path).exists():
+        return None
+    con = sqlite3.connect(db_path)
+    try:
+        row = con.execute("SELECT version FROM db_version").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    con.close()
+    return row[0] if row else None
+
+
+def stamp_version(db_path, version):
+    con = sqlite3.connect(db_path)
+    with con:
+        con.execute("CREATE TABLE IF NOT EXISTS db_version (version TEXT NOT NULL)")
+        con.execute("DELETE FROM db_version")
+        con.execute("INSERT INTO db_version (version) VALUES (?)", (version,))
+    con.close()
+
+
+def build_table_delta(con, table_name, primary_key):
+    columns = [row[1] for row in con.execute(f'PRAGMA main.table_info("{table_name}")')]
+    quoted_columns = ", ".join(f'"{col}"' for col in columns)
+    upserts = con.execute(
+        f'SELECT {quoted_columns} FROM main."{table_name}" '
+        f'EXCEPT SELECT {quoted_columns} FROM previous."{table_name}"'
+    ).fetchall()
+    deletes = con.execute(
+        f'SELECT "{primary_key}" FROM previous."{table_name}" '
+        f'WHERE "{primary_key}" NOT IN (SELECT "{primary_key}" FROM main."{table_name}")'
+    ).fetchall()
+    return {
+        "primary_key": primary_key,
+        "columns": columns,
+        "upserts": [list(row) for row in upserts],
+        "deletes": [row[0] for row in deletes],
+    }
+
+
+def build_delta(previous_db_path, db_path, from_version, to_version):
+    con = sqlite3.connect(db_path)
+    con.execute("ATTACH DATABASE ? AS previous", (str(previous_db_path),))
+    delta = {
+        "from_version": from_version,
+        "to_version": to_version,
+        "tables": {
+            table_name: build_table_delta(con, table_name, primary_key)
+            for table_name, primary_key in SYNCED_TABLES.items()
+        },
+    }
+    con.close()
+    return gzip.compress(json.dumps(delta).encode("utf-8"))
+
+
+def get_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def compress_database(db_path, compressed_db_path):
+    with open(db_path, "rb") as f_in, gzip.open(compressed_db_path, "wb", compresslevel=9) as f_out:
+        shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+
+def load_manifest(db_folder):
+    manifest_path = pathlib.Path(db_folder) / MANIFEST_FILE_NAME
+    if not manifest_path.exists():
+        return {"version": None, "deltas": []}
+    return json.loads(manifest_path.read_text())
+
+
+def publish(previous_db_path, db_folder, to_version):
+    db_folder = pathlib.Path(db_folder)
+    db_path = db_folder / "database.db"
+    deltas_folder = db_folder / DELTAS_FOLDER_NAME
+    deltas_folder.mkdir(exist_ok=True)
+    manifest = load_manifest(db_folder)
+
+    from_version = get_version(previous_db_path)
+    stamp_version(db_path, to_version)
+    if from_version is not None and from_version != to_version:
+        delta_path = f"{DELTAS_FOLDER_NAME}/{from_version}__{to_version}.json.gz"
+        delta_bytes = build_delta(previous_db_path, db_path, from_version, to_version)
+        (db_folder / delta_path).write_bytes(delta_bytes)
+        manifest["deltas"].append(
+            {
+                "from_version": from_version,
+                "to_version": to_version,
+                "path": delta_path,
+                "size": len(delta_bytes),
+            }
+        )
+
+    manifest["deltas"] = manifest["deltas"][-MAX_DELTAS:]
+    manifest["version"] = to_version
+    manifest["database_size"] = db_path.stat().st_size
+    manifest["database_sha256"] = get_sha256(db_path)
+    compressed_db_path = db_folder / COMPRESSED_DB_FILE_NAME
+    compress_database(db_path, compressed_db_path)
+    manifest["database_gz_size"] = compressed_db_path.stat().st_size
+    kept_paths = {delta["path"] for delta in manifest["deltas"]}
+    for delta_file in deltas_folder.iterdir():
+        if f"{DELTAS_FOLDER_NAME}/{delta_file.name}" not in kept_paths:
+            delta_file.unlink()
+    (db_folder / MANIFEST_FILE_NAME).write_text(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    publish(*sys.argv[1:4])
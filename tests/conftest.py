@@ -0,0 +1,31 @@
+import pathlib
+import sys
+
+import pytest
+
+ROOT_PATH = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_PATH / "app"))
+sys.path.insert(0, str(ROOT_PATH / "benchmarks"))
+
+
+@pytest.fixture
+def app_folder(tmp_path, monkeypatch):
+    # A small synthetic sporacle DB and local DB, set up like the app does
+    import data
+    import synthetic_data
+
+    monkeypatch.chdir(tmp_path)
+    synthetic_data.generate(
+        folder=tmp_path,
+        seasons=2,
+        competitions=2,
+        matches_per_competition=20,
+        bet_lists=20,
+        legs_per_bet_list=3,
+    )
+    data.reset_engines()
+    data.invalidate_result_cache()
+    data.init_database()
+    yield tmp_path
+    data.reset_engines()
+    data.invalidate_result_cache()
@@ -0,0 +1,73 @@
+import itertools
+import math
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "dc_strategy",
+    [
+        {"competition_codes": [999]},
+        {"min_odd_value": 50.0, "max_odd_value": 60.0},
+    ],
+    ids=["unknown competition", "no odd in range"],
+)
+def test_backtest_without_matching_odds_returns_zeroed_metrics(app_folder, dc_strategy):
+    dc_backtest = data.run_backtest(dc_strategy)
+    assert dc_backtest["metrics"] == {
+        "bet_list_count": 0,
+        "winning_count": 0,
+        "hit_rate": 0.0,
+        "stakes": 0.0,
+        "returns": 0.0,
+        "roi": 0.0,
+        "max_drawdown": 0.0,
+    }
+    assert dc_backtest["df_seasons"].empty
+    assert dc_backtest["df_seasons"].columns.to_list() == data.BACKTEST_SEASON_COLUMNS
+    assert dc_backtest["df_days"].empty
+    assert dc_backtest["df_days"].columns.to_list() == [
+        *data.BACKTEST_DAY_COLUMNS, "season", "profit"
+    ]
+
+
+def test_backtest_seasons_add_up_to_the_overall_metrics(app_folder):
+    dc_backtest = data.run_backtest({"legs": 2, "max_odds_per_day": 6})
+    df_seasons = dc_backtest["df_seasons"]
+    assert df_seasons.columns.to_list() == data.BACKTEST_SEASON_COLUMNS
+    assert df_seasons["bet_list_count"].sum() == dc_backtest["metrics"]["bet_list_count"] > 0
+    assert df_seasons["returns"].sum() == pytest.approx(dc_backtest["metrics"]["returns"])
+
+
+def test_backtest_without_bet_lists_returns_zeroed_metrics(app_folder):
+    # Odds match the strategy but a day never has 8 different matches
+    dc_metrics = data.run_backtest({"legs": 8, "max_odds_per_day": 10})["metrics"]
+    assert dc_metrics["bet_list_count"] == 0
+    assert dc_metrics["hit_rate"] == 0.0
+    assert dc_metrics["roi"] == 0.0
+
+
+def test_match_day_totals_match_every_bet_list(app_folder):
+    df_odds = data.get_backtest_odds(data.BACKTEST_DEFAULT_STRATEGY)
+    dc_strategy = data.BACKTEST_DEFAULT_STRATEGY | {"legs": 3, "max_odds_per_day": 12}
+    for _, df_day_odds in itertools.islice(df_odds.groupby("match_day"), 5):
+        df_pool = df_day_odds.sort_values("odd_value", kind="stable").head(12)
+        ls_bet_lists = [
+            combination
+            for combination in itertools.combinations(df_pool.itertuples(), 3)
+            if len({odd.odd_match_code for odd in combination}) == 3
+        ]
+        ls_winning_bet_lists = [
+            combination for combination in ls_bet_lists
+            if all(odd.is_winning for odd in combination)
+        ]
+        dc_day = data.backtest_match_day(df_day_odds, dc_strategy)
+        assert dc_day["bet_list_count"] == len(ls_bet_lists)
+        assert dc_day["winning_count"] == len(ls_winning_bet_lists)
+        assert dc_day["returns"] == pytest.approx(
+            sum(math.prod(odd.odd_value for odd in combination) for combination in ls_winning_bet_lists)
+        )
@@ -0,0 +1,87 @@
+import io
+import warnings
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+
+def test_settled_bet_list_pages_match_full_history(app_folder):
+    assert data.settle_bet_lists() > 0
+    dc_counts = data.get_settled_bet_lists_count()
+    df_wide = data.get_bet_lists_wide_df()
+    df_evaluation = data.get_bet_lists_evaluation(df_wide)
+    assert dc_counts == {
+        "winning": int(df_evaluation["is_winning"].sum()),
+        "losing": int((~df_evaluation["is_winning"]).sum()),
+    }
+    for is_winning, bet_list_count in [(True, dc_counts["winning"]), (False, dc_counts["losing"])]:
+        ls_bet_list_names = []
+        for page in range(-(-bet_list_count // 3) + 1):
+            df_page = data.get_settled_bet_lists(is_winning, page=page, page_size=3)
+            assert len(df_page) <= 3
+            ls_bet_list_names.extend(df_page.index)
+        assert len(ls_bet_list_names) == len(set(ls_bet_list_names)) == bet_list_count
+        df_legs = data.get_bet_list_legs(tuple(ls_bet_list_names))
+        df_expected = (
+            df_wide[df_wide["bet_list_name"].isin(ls_bet_list_names)]
+            .sort_values("bet_list_name", kind="stable")
+            .reset_index(drop=True)
+        )
+        assert df_legs.equals(df_expected)
+
+
+def get_file(rows, columns=("bet_list_name", "position", "key")):
+    return io.BytesIO(pd.DataFrame(rows, columns=list(columns)).to_csv(index=False).encode())
+
+
+def test_import_rejects_invalid_bet_lists_without_raising(app_folder):
+    ls_match_keys = data.get_table_from_query(
+        data.IN_MEMORY_SQLALCHEMY_DB_ENGINE,
+        "SELECT key, odd_match_code FROM sporacle_db.odds ORDER BY odd_match_code, key"
+    ).groupby("odd_match_code")["key"].agg(list).to_list()
+    key_1, key_1_bis = ls_match_keys[0][:2]
+    key_2 = ls_match_keys[1][0]
+    key_3 = ls_match_keys[2][0]
+    bet_lists_file = get_file(
+        [
+            ("valid", 0, key_1),
+            ("valid", 1, key_2),
+            ("duplicate position", 0, key_1),
+            ("duplicate position", 0, key_2),
+            ("duplicate key", 0, key_1),
+            ("duplicate key", 1, key_1),
+            ("same match", 0, key_1),
+            ("same match", 1, key_1_bis),
+            ("unknown key", 0, key_3),
+            ("unknown key", 1, "0_unknown"),
+            ("invalid position", "first", key_3),
+            ("missing key", 0, None),
+            (None, 0, key_3),
+        ]
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        dc_result = data.import_bet_lists(bet_lists_file, "csv")
+    assert dc_result["imported"] == 1
+    assert dc_result["rejected"] == {
+        data.UNNAMED_BET_LIST: "1 row(s) ignored",
+        "duplicate position": "duplicate position: 0",
+        "duplicate key": f"duplicate odd keys: {key_1}",
+        "same match": f"several odds of the same match: {key_1}, {key_1_bis}",
+        "unknown key": "unknown odd keys: 0_unknown",
+        "invalid position": f"invalid position: {key_3}",
+        "missing key": "missing odd key: 0",
+    }
+    assert data.get_table_from_query(
+        data.IN_MEMORY_SQLALCHEMY_DB_ENGINE,
+        "SELECT key FROM app_db.bet_list_odds WHERE bet_list_name = 'valid' ORDER BY position"
+    )["key"].to_list() == [key_1, key_2]
+
+
+def test_import_requires_the_bet_list_name_and_key_columns(app_folder):
+    with pytest.raises(ValueError, match="key"):
+        data.import_bet_lists(get_file([("a", 0)], columns=("bet_list_name", "position")), "csv")
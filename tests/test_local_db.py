@@ -0,0 +1,44 @@
+import json
+import sqlite3
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+
+def write_v0_local_db(db_path, odds):
+    # Schema version 0: the odd keys only live in the bet_lists.odds JSON array
+    con = sqlite3.connect(db_path)
+    with con:
+        con.execute(
+            "CREATE TABLE bet_lists (bet_list_name VARCHAR PRIMARY KEY, creation_date DATETIME, "
+            "modification_date DATETIME, odds JSON NOT NULL, earliest_match_date DATETIME, "
+            "last_match_date DATETIME)"
+        )
+        con.execute(
+            "INSERT INTO bet_lists VALUES ('old bet list', '2024-01-01', '2024-01-01', ?, NULL, NULL)",
+            (odds,)
+        )
+    con.close()
+
+
+def test_uploaded_v0_db_is_migrated(app_folder):
+    write_v0_local_db("upload.db", json.dumps(["1_1", "2_X"]))
+    with open("upload.db", "rb") as uploaded_file:
+        data.add_uploaded_db_file(uploaded_file)
+    assert data.get_table_from_query(
+        data.IN_MEMORY_SQLALCHEMY_DB_ENGINE,
+        "SELECT key FROM app_db.bet_list_odds ORDER BY position"
+    )["key"].to_list() == ["1_1", "2_X"]
+
+
+def test_failed_migration_keeps_the_current_local_db(app_folder):
+    bet_list_count = len(data.get_bet_list_names_in_db())
+    write_v0_local_db("upload.db", "[not json")
+    with open("upload.db", "rb") as uploaded_file:
+        with pytest.raises(ValueError, match="could not be migrated"):
+            data.add_uploaded_db_file(uploaded_file)
+    assert not list(app_folder.glob(f"{data.LOCAL_DB_PATH}.upload*"))
+    assert len(data.get_bet_list_names_in_db()) == bet_list_count
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+VALUES_QUERY = """
+    WITH RECURSIVE numbers(n) AS (
+        SELECT 0 UNION ALL SELECT n + 1 FROM numbers WHERE n + 1 < 10
+    )
+    SELECT n, {value_sql} as v FROM numbers ORDER BY n
+"""
+
+
+@pytest.fixture
+def small_batches(app_folder, monkeypatch):
+    # Batches of 3 rows: the values below change type across batch boundaries
+    monkeypatch.setattr(data, "FETCH_ARRAYSIZE", 3)
+
+
+def get_values(value_sql):
+    return data.get_table_from_query(
+        data.IN_MEMORY_SQLALCHEMY_DB_ENGINE, VALUES_QUERY.format(value_sql=value_sql)
+    )["v"]
+
+
+def test_mixed_storage_classes_across_batches_give_an_object_column(small_batches):
+    s_values = get_values("CASE WHEN n < 5 THEN n ELSE 'text ' || n END")
+    assert s_values.dtype == object
+    assert s_values.to_list() == [0, 1, 2, 3, 4, "text 5", "text 6", "text 7", "text 8", "text 9"]
+
+
+def test_mixed_storage_classes_within_a_batch_give_an_object_column(small_batches):
+    s_values = get_values("CASE WHEN n % 2 = 0 THEN n ELSE 'text' END")
+    assert s_values.dtype == object
+    assert s_values.to_list() == [0, "text", 2, "text", 4, "text", 6, "text", 8, "text"]
+
+
+def test_integer_and_real_batches_give_a_float_column(small_batches):
+    s_values = get_values("CASE WHEN n < 5 THEN n ELSE n + 0.5 END")
+    assert s_values.dtype == "float64"
+    assert s_values.to_list() == [0, 1, 2, 3, 4, 5.5, 6.5, 7.5, 8.5, 9.5]
+
+
+def test_null_batches_take_the_type_of_later_batches(small_batches):
+    s_values = get_values("CASE WHEN n < 5 THEN NULL ELSE 'text' END")
+    assert pd.api.types.is_string_dtype(s_values)
+    assert s_values.isna().to_list() == [True] * 5 + [False] * 5
+    assert s_values.dropna().to_list() == ["text"] * 5
+
+
+def test_dtype_hints_apply_to_the_whole_result(small_batches):
+    df = data.get_table_from_query(
+        data.IN_MEMORY_SQLALCHEMY_DB_ENGINE,
+        VALUES_QUERY.format(value_sql="CASE WHEN n < 5 THEN n ELSE 'text' END"),
+        dtypes={"n": "float", "v": "category"}
+    )
+    assert df["n"].dtype == "float64"
+    assert isinstance(df["v"].dtype, pd.CategoricalDtype)
+    assert df["v"].astype(str).to_list() == ["0", "1", "2", "3", "4"] + ["text"] * 5
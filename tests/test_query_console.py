@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+ROWS_QUERY = """
+    WITH RECURSIVE numbers(n) AS (
+        SELECT 0 UNION ALL SELECT n + 1 FROM numbers WHERE n + 1 < {row_count}
+    )
+    SELECT n FROM numbers
+"""
+
+
+@pytest.mark.parametrize(
+    "row_count, row_cap, expected_row_count, expected_is_capped",
+    [(9, 10, 9, False), (10, 10, 10, False), (11, 10, 10, True), (50, 10, 10, True)],
+)
+def test_only_results_over_the_row_cap_are_capped(
+    app_folder, row_count, row_cap, expected_row_count, expected_is_capped
+):
+    dc_result = data.run_guarded_query(
+        "Sporacle", ROWS_QUERY.format(row_count=row_count), row_cap=row_cap, page_size=4
+    )
+    assert dc_result["row_count"] == expected_row_count
+    assert dc_result["is_capped"] == expected_is_capped
+
+
+def test_pages_never_show_rows_past_the_row_cap(app_folder):
+    ls_pages = [
+        data.run_guarded_query(
+            "Sporacle", ROWS_QUERY.format(row_count=50), page=page, page_size=5, row_cap=10
+        )["df_page"]
+        for page in range(3)
+    ]
+    assert [df_page["n"].to_list() for df_page in ls_pages] == [
+        [0, 1, 2, 3, 4], [5, 6, 7, 8, 9], []
+    ]
+
+
+def test_interrupted_export_leaves_no_partial_file(app_folder, monkeypatch):
+    monkeypatch.setattr(data, "QUERY_PROGRESS_OPCODES", 100)
+    dc_export = data.export_guarded_query(
+        "Sporacle",
+        ROWS_QUERY.format(row_count=10**9),
+        "query_export.csv",
+        time_budget=0.2
+    )
+    assert dc_export["is_interrupted"]
+    assert not (app_folder / "query_export.csv").exists()
+
+
+def test_export_writes_every_row(app_folder):
+    dc_export = data.export_guarded_query(
+        "Sporacle", ROWS_QUERY.format(row_count=25), "query_export.csv"
+    )
+    assert dc_export == {"row_count": 25, "is_interrupted": False}
+    assert (app_folder / "query_export.csv").read_text().splitlines() == [
+        "n", *map(str, range(25))
+    ]
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+
+@pytest.fixture
+def ls_calls(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data.invalidate_result_cache()
+    yield []
+    data.invalidate_result_cache()
+
+
+def test_result_cache_is_bounded_by_result_size(ls_calls, monkeypatch):
+    @data.cached_result
+    def get_frame(row_count):
+        ls_calls.append(row_count)
+        return pd.DataFrame({"value": np.zeros(row_count)})
+
+    # Room for 2500 float64 values (and their index)
+    monkeypatch.setattr(data, "RESULT_CACHE_MAX_BYTES", 2500 * 8 + 1024)
+    get_frame(1000)
+    get_frame(1000)
+    assert ls_calls == [1000]
+    # Both entries do not fit together, the least recently used one is evicted
+    get_frame(2000)
+    get_frame(1000)
+    assert ls_calls == [1000, 2000, 1000]
+    assert data._result_cache_size <= data.RESULT_CACHE_MAX_BYTES
+    # A result bigger than the whole cache is returned but never cached
+    get_frame(3000)
+    get_frame(3000)
+    assert ls_calls == [1000, 2000, 1000, 3000, 3000]
+    get_frame(1000)
+    assert ls_calls == [1000, 2000, 1000, 3000, 3000]
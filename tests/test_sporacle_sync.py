@@ -0,0 +1,122 @@
+import asyncio
+import gzip
+import json
+import sqlite3
+import zlib
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+import data  # noqa: E402
+
+
+def stamp_sporacle_db_version(version):
+    data.reset_engines()
+    con = sqlite3.connect(data.SPORACLE_DB_PATH)
+    with con:
+        con.execute("CREATE TABLE IF NOT EXISTS db_version (version TEXT NOT NULL)")
+        con.execute("DELETE FROM db_version")
+        con.execute("INSERT INTO db_version (version) VALUES (?)", (version,))
+    con.close()
+
+
+def get_delta_bytes(tables, from_version="v1", to_version="v2"):
+    return gzip.compress(
+        json.dumps(
+            {"from_version": from_version, "to_version": to_version, "tables": tables}
+        ).encode()
+    )
+
+
+def get_corrupted_delta_bytes():
+    # Valid gzip header, invalid deflate block type
+    delta_bytes = bytearray(get_delta_bytes({}))
+    delta_bytes[10:13] = b"\xff\xff\xff"
+    return bytes(delta_bytes)
+
+
+def run_sync(ls_sporacle_deltas):
+    ls_full_setups = []
+
+    async def full_app_setup():
+        ls_full_setups.append(True)
+
+    asyncio.run(data.delta_app_setup_or_fallback(ls_sporacle_deltas, full_app_setup))
+    return ls_full_setups
+
+
+def test_valid_delta_is_applied(app_folder):
+    stamp_sporacle_db_version("v1")
+    delta_bytes = get_delta_bytes(
+        {
+            "competitions": {
+                "primary_key": "competition_code",
+                "columns": ["competition_code", "name", "is_top_competition"],
+                "upserts": [[1, "Renamed competition", 1]],
+                "deletes": [],
+            }
+        }
+    )
+    assert run_sync([delta_bytes]) == []
+    assert data.get_sporacle_db_version() == "v2"
+
+
+@pytest.mark.parametrize(
+    "delta_bytes",
+    [
+        b"not a gzip file",
+        get_delta_bytes({})[:-10],
+        get_corrupted_delta_bytes(),
+        gzip.compress(b"{not json"),
+        gzip.compress(b"[1, 2]"),
+        get_delta_bytes({"competitions": []}),
+        get_delta_bytes({}, from_version="v0"),
+        get_delta_bytes(
+            {
+                "missing_table": {
+                    "primary_key": "code",
+                    "columns": ["code"],
+                    "upserts": [[1]],
+                    "deletes": [],
+                }
+            }
+        ),
+    ],
+    ids=[
+        "bad gzip",
+        "truncated delta",
+        "corrupted deflate",
+        "bad json",
+        "not an object",
+        "bad table delta",
+        "version mismatch",
+        "unknown table",
+    ],
+)
+def test_bad_delta_falls_back_to_full_download(app_folder, delta_bytes):
+    stamp_sporacle_db_version("v1")
+    assert run_sync([delta_bytes]) == [True]
+
+
+async def iter_chunks(ls_chunks):
+    for chunk in ls_chunks:
+        yield chunk
+
+
+@pytest.mark.parametrize(
+    "ls_chunks, expected_sha256",
+    [
+        ([b"not a gzip stream"], "0" * 64),
+        ([gzip.compress(b"SQLite format 3\x00")[:-4]], "0" * 64),
+        ([gzip.compress(b"SQLite format 3\x00")], "0" * 64),
+    ],
+    ids=["bad gzip", "truncated gzip", "wrong checksum"],
+)
+def test_failed_compressed_download_leaves_no_part_file(
+    tmp_path, monkeypatch, ls_chunks, expected_sha256
+):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises((ValueError, zlib.error)):
+        asyncio.run(data.write_compressed_sporacle_db(iter_chunks(ls_chunks), expected_sha256))
+    assert list(tmp_path.iterdir()) == []